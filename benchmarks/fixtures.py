@@ -0,0 +1,215 @@
+"""Synthetic Stud.IP pages for the benchmarks
+
+The pages mimic the markup the parsers rely on, filled with random but reproducible names, so
+no personal data of a real Stud.IP instance is needed. Every generator takes a count and a seed.
+"""
+
+import html
+import json
+import random
+
+WORDS = ["Analysis", "Algebra", "Informatik", "Grundlagen", "Seminar", "Übung", "Vorlesung",
+         "Praktikum", "Statistik", "Datenbanken", "Netzwerke", "Physik", "Chemie", "Ethik",
+         "Geschichte", "Recht", "Ökonomie", "Projekt", "Kolloquium", "Tutorium"]
+
+EXTENSIONS = ["pdf", "zip", "pptx", "docx", "mp4", "txt", "ipynb"]
+
+PAGE_HEADER = """<!DOCTYPE html>
+<html class="no-js" lang="de-DE">
+<head>
+    <meta charset="utf-8">
+    <title>Stud.IP</title>
+    <link rel="stylesheet" href="/assets/stylesheets/studip-base.css">
+    <script src="/assets/javascripts/studip-base.js"></script>
+</head>
+<body id="{body_id}">
+<div id="layout_wrapper">
+<nav id="navigation-level-1">{navigation}</nav>
+<div id="layout_content">
+"""
+
+PAGE_FOOTER = """
+</div>
+</div>
+<footer id="main-footer"><ul><li><a href="/dispatch.php/siteinfo/show">Impressum</a></li></ul>
+</footer>
+</body>
+</html>
+"""
+
+
+def hex_id(rng):
+    return "%032x" % rng.getrandbits(128)
+
+
+def title(rng, words=3):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def page(body_id, content, rng):
+    navigation = "".join('<a href="/dispatch.php/{0}">{1}</a>'.format(hex_id(rng), title(rng, 1))
+                         for _ in range(20))
+
+    return PAGE_HEADER.format(body_id=body_id, navigation=navigation) + content + PAGE_FOOTER
+
+
+def file_data(rng, base_url="https://studip.example.org"):
+    file_id = hex_id(rng)
+    name = "{}.{}".format(title(rng), rng.choice(EXTENSIONS))
+
+    return {
+        "id": file_id,
+        "file_id": hex_id(rng),
+        "name": name,
+        "size": rng.randint(1000, 50 * 1024 * 1024),
+        "mime_type": "application/octet-stream",
+        "downloads": rng.randint(0, 500),
+        "icon": "file-pdf",
+        "download_url": "{}/sendfile.php?type=0&file_id={}&file_name={}".format(
+            base_url, file_id, name),
+        "author_name": title(rng, 2),
+        "author_url": "{}/dispatch.php/profile?username={}".format(base_url, hex_id(rng)[:8]),
+        "chdate": rng.randint(1500000000, 1700000000),
+        "isEditable": False,
+        "restrictedTermsOfUse": False
+    }
+
+
+def folder_data(rng):
+    return {
+        "id": hex_id(rng),
+        "name": title(rng, 2),
+        "icon": "folder-full",
+        "permissions": "rd",
+        "chdate": rng.randint(1500000000, 1700000000),
+        "author_name": title(rng, 2),
+        "isEditable": False
+    }
+
+
+def files_form(files, folders, rng):
+    return ('<form id="files_table_form" method="post" action="/dispatch.php/file/bulk/{0}" '
+            'data-files="{1}" data-folders="{2}">\n'
+            '<input type="hidden" name="security_token" value="{3}">\n'
+            '<input type="hidden" name="parent_folder_id" value="{0}">\n'
+            '<table class="default documents"><tbody></tbody></table>\n'
+            '</form>').format(hex_id(rng), html.escape(json.dumps(files)),
+                              html.escape(json.dumps(folders)), hex_id(rng))
+
+
+def my_courses(courses, seed=1, semesters=8):
+    """dispatch.php/my_courses with MyCoursesData"""
+    rng = random.Random(seed)
+
+    data = {"courses": {}, "groups": []}
+    course_ids = [hex_id(rng) for _ in range(courses)]
+
+    for course_id in course_ids:
+        data["courses"][course_id] = {
+            "id": course_id,
+            "name": title(rng, 4),
+            "number": str(rng.randint(1000, 9999)),
+            "admission_binding": False,
+            "children": [],
+            "navigation": [{"url": "/dispatch.php/course/files?cid=" + course_id,
+                            "icon": "files", "important": False, "title": "Dateien"}]
+        }
+
+    per_semester = max(1, courses // semesters)
+    for i in range(semesters):
+        ids = course_ids[i * per_semester:(i + 1) * per_semester]
+        data["groups"].append({"id": hex_id(rng), "name": "WiSe {0}/{1}".format(10 + i, 11 + i),
+                               "data": [{"id": hex_id(rng), "label": False, "ids": ids}]})
+
+    content = ('<div id="my-courses"></div>\n'
+               '<script>\nSTUDIP.MyCoursesData = {};\n</script>\n').format(json.dumps(data))
+
+    return page("my_courses-index", content, rng)
+
+
+def files_flat(files, seed=1):
+    """dispatch.php/course/files/flat with the data-files JSON"""
+    rng = random.Random(seed)
+
+    return page("course-files-flat", files_form([file_data(rng) for _ in range(files)], [], rng),
+                rng)
+
+
+def files_flat_table(files, seed=1):
+    """dispatch.php/course/files/flat of older Stud.IP versions, which only have an HTML table"""
+    rng = random.Random(seed)
+
+    rows = []
+    for _ in range(files):
+        data = file_data(rng)
+        rows.append('<tr id="fileref_{0}"><td><input type="checkbox" name="ids[]" value="{0}">'
+                    '</td><td><img src="/assets/images/icons/blue/file.svg"></td>'
+                    '<td><a href="{1}">{2}</a></td><td data-sort-value="{3}">{3}</td>'
+                    '<td>{4}</td><td>{5}</td><td data-sort-value="{6}">{6}</td>'
+                    '<td class="actions"></td></tr>'.format(
+                        data["id"], html.escape(data["download_url"]), html.escape(data["name"]),
+                        data["size"], data["downloads"], html.escape(data["author_name"]),
+                        data["chdate"]))
+
+    content = ('<form method="post" action="/dispatch.php/file/bulk/{0}">'
+               '<table class="default documents"><tbody>{1}</tbody></table>'
+               '</form>').format(hex_id(rng), "".join(rows))
+
+    return page("course-files-flat", content, rng)
+
+
+def files_index(files, folders, seed=1):
+    """dispatch.php/course/files/index with data-files and data-folders"""
+    rng = random.Random(seed)
+
+    return page("course-files-index",
+                files_form([file_data(rng) for _ in range(files)],
+                           [folder_data(rng) for _ in range(folders)], rng),
+                rng)
+
+
+def media_list(media, seed=1):
+    """plugins.php/mediacastplugin/media/index"""
+    rng = random.Random(seed)
+
+    tables = []
+    for i in range(media):
+        media_hash = hex_id(rng)
+        if i % 2 == 0:
+            curtain = '<div class="overlay-curtain"><a href="#play-{}">Abspielen</a></div>'.format(
+                media_hash)
+            media_url = "/plugins.php/mediacastplugin/media/player/" + media_hash
+        else:
+            curtain = ""
+            media_url = "/plugins.php/mediacastplugin/media/check/{}.mp4".format(media_hash)
+
+        tables.append('<table class="media-table" id="{0}"><tr><td>{1}'
+                      '<div class="media-table-infos"><div><a href="{2}">{3}</a></div>'
+                      '<div>{4}</div></div></td></tr></table>'.format(
+                          media_hash, curtain, media_url, html.escape(title(rng, 4)),
+                          html.escape(title(rng, 12))))
+
+    return page("mediacast-index", "\n".join(tables), rng)
+
+
+def media_player(variant, seed=1):
+    """Player page of a media file, each variant is found by another strategy"""
+    rng = random.Random(seed)
+    media_hash = hex_id(rng)
+    media_url = "/plugins.php/mediacastplugin/media/check/{}.mp4".format(media_hash)
+
+    if variant == "table":
+        content = ('<table id="dllist"><tr><td>Download</td><td><a href="{0}">1080p</a></td>'
+                   '<td><a href="{0}?q=720">720p</a></td></tr></table>').format(media_url)
+    elif variant == "iframe":
+        content = '<iframe id="framed_player" src="{}"></iframe>'.format(media_url)
+    elif variant == "video":
+        content = '<video id="mediaplayer_html5_api" src="{}"></video>'.format(media_url)
+    else:
+        content = '<script>var player = {{"sources": ["{}"]}};</script>'.format(media_url)
+
+    # Comments of a long discussion below the player
+    content += "".join('<div class="comment"><p>{}</p></div>'.format(html.escape(title(rng, 30)))
+                       for _ in range(200))
+
+    return page("mediacast-player", content, rng)
@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""Local stand-in for a Stud.IP server with synthetic courses, files and media
+
+Implements the pages and API endpoints used by studip_sync.session.URL and the general login.
+Listings send an ETag and answer If-None-Match with 304, downloads support Range and If-Range.
+Latency and failing requests can be injected. GET /_stats returns the number of requests and
+bytes served so far, POST /_stats resets them.
+
+    python benchmarks/mock_server.py --port 8080 --courses 20 --files 10 --latency 0.02
+"""
+
+import argparse
+import hashlib
+import html
+import io
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+import zipfile
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+SESSION_COOKIE = "Seminar_Session"
+
+
+def hex_id(*parts):
+    return hashlib.md5("/".join(str(part) for part in parts).encode()).hexdigest()
+
+
+class MockData(object):
+    """Synthetic courses with a folder tree and media files each
+
+    Every folder has `files` files and `branching` subfolders, down to `depth` levels. With
+    `shared_files`, the n-th file of every folder is a copy of the same underlying file, like
+    slides that are reused across courses. The top folder of every course additionally has
+    `forbidden` subfolders, which are listed but can't be opened.
+    """
+
+    def __init__(self, courses=10, semesters=2, depth=2, branching=2, files=5, file_size=64 * 1024,
+                 media=2, media_size=256 * 1024, shared_files=False, forbidden=1, seed=1):
+        super(MockData, self).__init__()
+        self.file_size = file_size
+        self.media_size = media_size
+        self.shared_files = shared_files
+        self.rng = random.Random(seed)
+        self.chdate = 1600000000
+
+        self.courses = {}
+        self.folders = {}
+        self.files = {}
+        self.media = {}
+        self.semesters = []
+
+        for semester in range(semesters):
+            self.semesters.append({"name": "Semester {}".format(semester + 1), "courses": []})
+
+        for course in range(courses):
+            course_id = hex_id("course", seed, course)
+            top_folder = self._add_folder(course_id, "", depth, branching, files,
+                                          "{}/{}".format(seed, course))
+            self.courses[course_id] = {"name": "Course {}".format(course + 1),
+                                       "top_folder": top_folder}
+
+            for i in range(forbidden):
+                folder_id = hex_id("forbidden", seed, course, i)
+                self.folders[folder_id] = {"id": folder_id, "name": "Restricted {}".format(i + 1),
+                                           "course_id": course_id, "files": [], "subfolders": [],
+                                           "forbidden": True}
+                self.folders[top_folder]["subfolders"].append(folder_id)
+            self.semesters[course % semesters]["courses"].append(course_id)
+
+            self.media[course_id] = []
+            for i in range(media):
+                media_hash = hex_id("media", seed, course, i)
+                self.media[course_id].append({
+                    "hash": media_hash,
+                    "name": "Lecture {}.mp4".format(i + 1),
+                    "player": i % 2 == 0
+                })
+
+    def _add_folder(self, course_id, name, depth, branching, files, path):
+        folder_id = hex_id("folder", path)
+        folder = {"id": folder_id, "name": name, "course_id": course_id, "files": [],
+                  "subfolders": []}
+        self.folders[folder_id] = folder
+
+        for i in range(files):
+            file_id = hex_id("file", path, i)
+            content_id = hex_id("content", i) if self.shared_files else hex_id("content", path, i)
+            self.files[file_id] = {
+                "id": file_id,
+                "file_id": content_id,
+                "name": "File {}.pdf".format(i + 1),
+                "size": self.file_size,
+                "chdate": self.chdate + self.rng.randint(0, 10 ** 7),
+                "folder_id": folder_id
+            }
+            folder["files"].append(file_id)
+
+        if depth > 0:
+            for i in range(branching):
+                subfolder_id = self._add_folder(course_id, "Folder {}".format(i + 1), depth - 1,
+                                                branching, files, "{}/{}".format(path, i))
+                folder["subfolders"].append(subfolder_id)
+
+        return folder_id
+
+    @staticmethod
+    def content(seed, size):
+        """Deterministic content of a file, random so that it doesn't compress in the zips"""
+        return random.Random(seed).randbytes(size)
+
+    def file_content(self, file_id):
+        file = self.files[file_id]
+        return self.content(file["file_id"], file["size"])
+
+    def media_content(self, media_hash):
+        return self.content(media_hash, self.media_size)
+
+    def find_media(self, media_hash):
+        for media in self.media.values():
+            for media_file in media:
+                if media_file["hash"] == media_hash:
+                    return media_file
+
+        return None
+
+    def course_files(self, course_id):
+        return [file for file in self.files.values()
+                if self.folders[file["folder_id"]]["course_id"] == course_id]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    data = None
+    latency = 0.0
+    error_rate = 0.0
+    rng = random.Random(1)
+    lock = threading.Lock()
+    stats = {"requests": 0, "bytes": 0, "not_modified": 0, "errors": 0}
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass
+
+    def do_GET(self):
+        self.body = b""
+        self.route("GET")
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.body = self.rfile.read(length) if length else b""
+        self.route("POST")
+
+    def send(self, body, status=200, content_type="text/html; charset=utf-8", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(body)
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_listing(self, body, content_type="text/html; charset=utf-8"):
+        """Sends a page with an ETag, or 304 if the client already has it"""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        etag = '"{}"'.format(hashlib.sha256(body).hexdigest()[:32])
+        if self.headers.get("If-None-Match") == etag:
+            with self.lock:
+                self.stats["not_modified"] += 1
+            return self.send(b"", status=304, headers={"ETag": etag})
+
+        return self.send(body, content_type=content_type, headers={"ETag": etag})
+
+    def send_download(self, content, etag, content_type="application/octet-stream",
+                      headers=None):
+        """Sends a file, or the requested range of it if If-Range still matches"""
+        headers = dict(headers or {})
+        headers["ETag"] = etag
+        headers["Accept-Ranges"] = "bytes"
+
+        range_header = self.headers.get("Range")
+        if_range = self.headers.get("If-Range")
+        if range_header and range_header.startswith("bytes=") and \
+                (if_range is None or if_range == etag):
+            start = int(range_header[len("bytes="):].split("-")[0])
+            if start < len(content):
+                headers["Content-Range"] = "bytes {}-{}/{}".format(start, len(content) - 1,
+                                                                  len(content))
+                return self.send(content[start:], status=206, content_type=content_type,
+                                 headers=headers)
+
+        return self.send(content, content_type=content_type, headers=headers)
+
+    def is_logged_in(self):
+        return SESSION_COOKIE + "=" in (self.headers.get("Cookie") or "")
+
+    def route(self, method):
+        url = urllib.parse.urlparse(self.path)
+        path = url.path.lstrip("/")
+        query = urllib.parse.parse_qs(url.query)
+
+        if path == "_stats":
+            with self.lock:
+                stats = dict(self.stats)
+                if method == "POST":
+                    for key in self.stats:
+                        self.stats[key] = 0
+            return self.send(json.dumps(stats), content_type="application/json")
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if path == "":
+            return self.send(self.login_page())
+
+        if path == "login" and method == "POST":
+            return self.send("<html><body>Willkommen</body></html>",
+                             headers={"Set-Cookie": SESSION_COOKIE + "=1; Path=/"})
+
+        if not self.is_logged_in():
+            return self.send(self.login_page())
+
+        if self.error_rate:
+            with self.lock:
+                failed = self.rng.random() < self.error_rate
+                if failed:
+                    self.stats["errors"] += 1
+            if failed:
+                return self.send("Internal Server Error", status=500)
+
+        course_id = query.get("cid", [None])[0]
+        if course_id is not None and course_id not in self.data.courses:
+            return self.send("not found", status=404)
+
+        try:
+            return self.route_logged_in(method, path, query, course_id)
+        except KeyError:
+            return self.send("not found", status=404)
+
+    def route_logged_in(self, method, path, query, course_id):
+        data = self.data
+
+        if path == "dispatch.php/start":
+            return self.send("<html><body><h1>Meine Veranstaltungen</h1></body></html>")
+
+        if path == "dispatch.php/my_courses":
+            return self.send_listing(self.my_courses_page())
+
+        if path == "dispatch.php/course/files/flat":
+            return self.send_listing(self.files_page(data.course_files(course_id), [], None))
+
+        if path == "dispatch.php/course/files":
+            folder = data.folders[data.courses[course_id]["top_folder"]]
+            return self.send_listing(self.folder_page(folder))
+
+        if path.startswith("dispatch.php/course/files/index/"):
+            folder = data.folders[path.rsplit("/", 1)[1]]
+            if folder.get("forbidden"):
+                return self.send("<html><body>Zugriff verweigert</body></html>", status=403)
+            return self.send_listing(self.folder_page(folder))
+
+        if path.startswith("dispatch.php/file/bulk/") and method == "POST":
+            folder = data.folders[path.rsplit("/", 1)[1]]
+            form = urllib.parse.parse_qs(self.body.decode())
+            return self.send(self.bulk_zip(folder, form.get("ids[]", [])),
+                             content_type="application/zip")
+
+        if path.startswith("sendfile/"):
+            file_id = path.split("/")[1]
+            return self.send_download(data.file_content(file_id), '"{}"'.format(file_id))
+
+        if path.startswith("api.php/course/") and path.endswith("/top_folder"):
+            folder_id = data.courses[path.split("/")[2]]["top_folder"]
+            return self.send_listing(self.api_folder(data.folders[folder_id]),
+                                     content_type="application/json")
+
+        if path.startswith("api.php/folder/"):
+            folder = data.folders[path.split("/")[2]]
+            if folder.get("forbidden"):
+                return self.send("Forbidden", status=403)
+            return self.send_listing(self.api_folder(folder), content_type="application/json")
+
+        if path.startswith("api.php/file/") and path.endswith("/download"):
+            file_id = path.split("/")[2]
+            return self.send_download(data.file_content(file_id), '"{}"'.format(file_id))
+
+        if path == "plugins.php/mediacastplugin/media/index":
+            if not data.media.get(course_id):
+                return self.send("not found", status=500)
+            return self.send_listing(self.media_list_page(data.media[course_id]))
+
+        if path.startswith("plugins.php/mediacastplugin/media/player/"):
+            media_hash = path.rsplit("/", 1)[1]
+            return self.send(self.media_player_page(media_hash))
+
+        if path.startswith("plugins.php/mediacastplugin/media/check/"):
+            media_hash = path.rsplit("/", 1)[1].split(".")[0]
+            media_file = data.find_media(media_hash)
+            if media_file is None:
+                return self.send("not found", status=404)
+
+            disposition = 'attachment; filename="{}"'.format(media_file["name"])
+            return self.send_download(data.media_content(media_hash), '"{}"'.format(media_hash),
+                                      content_type="video/mp4",
+                                      headers={"Content-Disposition": disposition})
+
+        return self.send("not found", status=404)
+
+    def base_url(self):
+        return "http://{}/".format(self.headers["Host"])
+
+    def login_page(self):
+        return ('<html><body><form method="post" action="{}login">'
+                '<input type="hidden" name="security_token" value="{}">'
+                '<input type="hidden" name="login_ticket" value="{}">'
+                '<input type="text" name="loginname"><input type="password" name="password">'
+                '</form></body></html>').format(self.base_url(), hex_id("token"),
+                                                hex_id("ticket"))
+
+    def my_courses_page(self):
+        data = self.data
+        courses = {course_id: {"id": course_id, "name": course["name"]}
+                   for course_id, course in data.courses.items()}
+        groups = [{"id": hex_id("semester", i), "name": semester["name"],
+                   "data": [{"id": hex_id("group", i), "label": False,
+                             "ids": semester["courses"]}]}
+                  for i, semester in enumerate(data.semesters)]
+
+        return ("<html><body><div id=\"my-courses\"></div><script>\n"
+                "STUDIP.MyCoursesData = {};\n</script></body></html>").format(
+                    json.dumps({"courses": courses, "groups": groups}))
+
+    def file_json(self, file):
+        return {
+            "id": file["id"],
+            "file_id": file["file_id"],
+            "name": file["name"],
+            "size": file["size"],
+            "chdate": file["chdate"],
+            "download_url": "{}sendfile/{}".format(self.base_url(), file["id"]),
+            "mime_type": "application/pdf"
+        }
+
+    def files_page(self, files, folders, folder_id):
+        form_data_files = [self.file_json(file) for file in files]
+        form_data_folders = [{"id": folder["id"], "name": folder["name"]} for folder in folders]
+
+        return ('<html><body><form id="files_table_form" method="post" '
+                'action="{base}dispatch.php/file/bulk/{folder_id}" data-files="{files}" '
+                'data-folders="{folders}">'
+                '<input type="hidden" name="security_token" value="{token}">'
+                '<input type="hidden" name="parent_folder_id" value="{folder_id}">'
+                '</form></body></html>').format(
+                    base=self.base_url(), folder_id=folder_id or "",
+                    files=html.escape(json.dumps(form_data_files)),
+                    folders=html.escape(json.dumps(form_data_folders)), token=hex_id("token"))
+
+    def folder_page(self, folder):
+        data = self.data
+        return self.files_page([data.files[file_id] for file_id in folder["files"]],
+                               [data.folders[folder_id] for folder_id in folder["subfolders"]],
+                               folder["id"])
+
+    def api_folder(self, folder):
+        data = self.data
+        file_refs = []
+        for file_id in folder["files"]:
+            file_ref = self.file_json(data.files[file_id])
+            file_ref["is_downloadable"] = True
+            file_refs.append(file_ref)
+
+        subfolders = [{"id": folder_id, "name": data.folders[folder_id]["name"]}
+                      for folder_id in folder["subfolders"]]
+
+        return json.dumps({"id": folder["id"], "file_refs": file_refs, "subfolders": subfolders})
+
+    def bulk_zip(self, folder, ids):
+        data = self.data
+        course_name = data.courses[folder["course_id"]]["name"]
+        ids = set(ids) - {folder["id"]}
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            def add_folder(folder_id, prefix):
+                current = data.folders[folder_id]
+                for file_id in current["files"]:
+                    file = data.files[file_id]
+                    info = zipfile.ZipInfo(prefix + file["name"],
+                                           time.localtime(file["chdate"])[:6])
+                    info.compress_type = zipfile.ZIP_DEFLATED
+                    archive.writestr(info, data.file_content(file_id))
+                for subfolder_id in current["subfolders"]:
+                    if data.folders[subfolder_id].get("forbidden"):
+                        continue
+                    add_folder(subfolder_id, prefix + data.folders[subfolder_id]["name"] + "/")
+
+            if ids:
+                for folder_id in ids:
+                    add_folder(folder_id, course_name + "/" + data.folders[folder_id]["name"] + "/")
+            else:
+                add_folder(folder["id"], course_name + "/")
+
+            archive.writestr("archive_filelist.csv", "Name;Größe\n")
+
+        return buffer.getvalue()
+
+    @staticmethod
+    def media_list_page(media):
+        tables = []
+        for media_file in media:
+            media_hash = media_file["hash"]
+            if media_file["player"]:
+                curtain = '<div class="overlay-curtain"><a href="#">Abspielen</a></div>'
+                media_url = "player/" + media_hash
+            else:
+                curtain = ""
+                media_url = "check/{}.mp4".format(media_hash)
+
+            tables.append('<table class="media-table" id="{}"><tr><td>{}'
+                          '<div class="media-table-infos"><div><a href="{}">{}</a></div></div>'
+                          '</td></tr></table>'.format(media_hash, curtain, media_url,
+                                                      html.escape(media_file["name"])))
+
+        return "<html><body>{}</body></html>".format("".join(tables))
+
+    @staticmethod
+    def media_player_page(media_hash):
+        return ('<html><body><table id="dllist"><tr><td>Download</td>'
+                '<td><a href="../check/{}.mp4">1080p</a></td></tr></table>'
+                '</body></html>').format(media_hash)
+
+
+class MockServer(ThreadingHTTPServer):
+    # The default backlog of 5 connections drops the bursts of concurrent clients
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # Clients may close idle keep-alive connections at any time
+        if isinstance(sys.exc_info()[1], ConnectionResetError):
+            return
+
+        super(MockServer, self).handle_error(request, client_address)
+
+
+def serve(data, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0, seed=1):
+    """Starts the server in a background thread and returns it, port 0 picks a free port"""
+    handler = type("MockHandler", (MockHandler,), {
+        "data": data,
+        "latency": latency,
+        "error_rate": error_rate,
+        "rng": random.Random(seed),
+        "lock": threading.Lock(),
+        "stats": {"requests": 0, "bytes": 0, "not_modified": 0, "errors": 0}
+    })
+
+    server = MockServer((host, port), handler)
+    server.daemon_threads = True
+
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    return server
+
+
+def add_data_arguments(parser):
+    parser.add_argument("--courses", type=int, default=10, help="number of courses")
+    parser.add_argument("--semesters", type=int, default=2, help="number of semesters")
+    parser.add_argument("--depth", type=int, default=2, help="depth of the folder trees")
+    parser.add_argument("--branching", type=int, default=2, help="subfolders per folder")
+    parser.add_argument("--files", type=int, default=5, help="files per folder")
+    parser.add_argument("--file-size", type=int, default=64 * 1024, help="size of every file")
+    parser.add_argument("--media", type=int, default=2, help="media files per course")
+    parser.add_argument("--media-size", type=int, default=256 * 1024,
+                        help="size of every media file")
+    parser.add_argument("--shared-files", action="store_true",
+                        help="let all folders share the same underlying files")
+    parser.add_argument("--forbidden", type=int, default=1,
+                        help="folders per course that can't be opened")
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="delay in seconds before every response")
+    parser.add_argument("--error-rate", type=float, default=0.0,
+                        help="fraction of requests that fail with status 500")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the generated data")
+
+
+def data_from_args(args):
+    return MockData(courses=args.courses, semesters=args.semesters, depth=args.depth,
+                    branching=args.branching, files=args.files, file_size=args.file_size,
+                    media=args.media, media_size=args.media_size,
+                    shared_files=args.shared_files, forbidden=args.forbidden, seed=args.seed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic Stud.IP data")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on")
+    add_data_arguments(parser)
+    args = parser.parse_args()
+
+    server = serve(data_from_args(args), args.host, args.port, args.latency, args.error_rate,
+                   args.seed)
+    print("Serving on http://{}:{}/".format(*server.server_address), flush=True)
+
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
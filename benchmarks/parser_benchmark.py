@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""Measures the time and peak memory of the parsers on realistic and extreme pages
+
+Every case is run --repeat times, the median time is reported together with the time of every
+strategy that try_parser_functions attempted. Peak memory is measured in separate runs with
+tracemalloc, so it doesn't distort the timings. The results can be saved as JSON and compared
+with the results of another commit:
+
+    python benchmarks/parser_benchmark.py --output before.json
+    python benchmarks/parser_benchmark.py --compare before.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from functools import wraps
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from benchmarks import fixtures
+from studip_sync import parsers
+
+
+def _courses(html):
+    return list(parsers.extract_courses(html, False))
+
+
+CASES = [
+    # name, extractor, function, page generator
+    ("courses-100", "extract_courses", _courses, lambda: fixtures.my_courses(100)),
+    ("courses-5000", "extract_courses", _courses, lambda: fixtures.my_courses(5000)),
+    ("flat-200", "extract_files_flat_last_edit", parsers.extract_files_flat_last_edit,
+     lambda: fixtures.files_flat(200)),
+    ("flat-10000", "extract_files_flat_last_edit", parsers.extract_files_flat_last_edit,
+     lambda: fixtures.files_flat(10000)),
+    ("flat-table-200", "extract_files_flat_last_edit", parsers.extract_files_flat_last_edit,
+     lambda: fixtures.files_flat_table(200)),
+    ("flat-table-10000", "extract_files_flat_last_edit", parsers.extract_files_flat_last_edit,
+     lambda: fixtures.files_flat_table(10000)),
+    ("index-100", "extract_files_index_data", parsers.extract_files_index_data,
+     lambda: fixtures.files_index(100, 10)),
+    ("index-10000", "extract_files_index_data", parsers.extract_files_index_data,
+     lambda: fixtures.files_index(10000, 500)),
+    ("media-list-20", "extract_media_list", parsers.extract_media_list,
+     lambda: fixtures.media_list(20)),
+    ("media-list-2000", "extract_media_list", parsers.extract_media_list,
+     lambda: fixtures.media_list(2000)),
+    ("media-player-table", "extract_media_best_download_link",
+     parsers.extract_media_best_download_link, lambda: fixtures.media_player("table")),
+    ("media-player-iframe", "extract_media_best_download_link",
+     parsers.extract_media_best_download_link, lambda: fixtures.media_player("iframe")),
+    ("media-player-video", "extract_media_best_download_link",
+     parsers.extract_media_best_download_link, lambda: fixtures.media_player("video")),
+    ("media-player-regex", "extract_media_best_download_link",
+     parsers.extract_media_best_download_link, lambda: fixtures.media_player("regex")),
+]
+
+
+class StrategyRecorder(object):
+    """Wraps the strategies passed to try_parser_functions to measure each of them"""
+
+    def __init__(self):
+        super(StrategyRecorder, self).__init__()
+        self.measure_memory = False
+        self.calls = []
+        self._original = parsers.try_parser_functions
+
+    def __enter__(self):
+        parsers.try_parser_functions = self.try_parser_functions
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        parsers.try_parser_functions = self._original
+
+    def try_parser_functions(self, html, func_attempts):
+        return self._original(html, [self.wrap(func) for func in func_attempts])
+
+    def wrap(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            if self.measure_memory:
+                start_memory = tracemalloc.get_traced_memory()[0]
+                tracemalloc.reset_peak()
+
+            start = time.perf_counter()
+            succeeded = False
+            try:
+                result = func(*args, **kwargs)
+                succeeded = True
+                return result
+            finally:
+                call = {"strategy": func.__name__, "time": time.perf_counter() - start,
+                        "succeeded": succeeded}
+                if self.measure_memory:
+                    call["peak_memory"] = tracemalloc.get_traced_memory()[1] - start_memory
+                self.calls.append(call)
+
+        return inner
+
+
+def measure_case(func, html, repeat):
+    result = {}
+
+    with StrategyRecorder() as recorder:
+        func(html)  # Warm up imports and caches
+
+        times = []
+        strategy_times = {}
+        strategy_results = {}
+        for _ in range(repeat):
+            recorder.calls = []
+
+            start = time.perf_counter()
+            func(html)
+            times.append(time.perf_counter() - start)
+
+            for call in recorder.calls:
+                strategy_times.setdefault(call["strategy"], []).append(call["time"])
+                strategy_results[call["strategy"]] = call["succeeded"]
+
+        result["time_median"] = statistics.median(times)
+        result["time_min"] = min(times)
+
+        # Memory of the whole extractor, without the strategies resetting the peak in between.
+        # The soups of earlier runs are reference cycles, they must not be freed while measuring.
+        gc.collect()
+        tracemalloc.start()
+        start_memory = tracemalloc.get_traced_memory()[0]
+        func(html)
+        result["peak_memory"] = tracemalloc.get_traced_memory()[1] - start_memory
+
+        recorder.measure_memory = True
+        recorder.calls = []
+        gc.collect()
+        func(html)
+        tracemalloc.stop()
+
+        strategy_peaks = {call["strategy"]: call["peak_memory"] for call in recorder.calls}
+
+    result["strategies"] = {
+        strategy: {
+            "time_median": statistics.median(strategy_times[strategy]),
+            "succeeded": strategy_results[strategy],
+            "peak_memory": strategy_peaks.get(strategy)
+        }
+        for strategy in strategy_times
+    }
+
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_page(case_name, generate, fixtures_dir):
+    if fixtures_dir:
+        path = os.path.join(fixtures_dir, case_name + ".html")
+        if os.path.isfile(path):
+            with open(path, encoding="utf-8") as file:
+                return file.read()
+
+    return generate()
+
+
+def format_size(size):
+    return "{:.1f} MiB".format(size / 1024 / 1024)
+
+
+def print_results(results, baseline=None, threshold=1.25):
+    regressions = []
+
+    print("{:<22} {:<34} {:>8} {:>11} {:>12}{}".format(
+        "case", "extractor / strategy", "size", "median", "peak memory",
+        "  vs. baseline" if baseline else ""))
+
+    for case_name, case in results["cases"].items():
+        comparison = ""
+        if baseline and case_name in baseline["cases"]:
+            ratio = case["time_median"] / baseline["cases"][case_name]["time_median"]
+            comparison = "  {:.2f}x".format(ratio)
+            if ratio > threshold:
+                comparison += " REGRESSION"
+                regressions.append(case_name)
+
+        print("{:<22} {:<34} {:>8} {:>9.2f}ms {:>12}{}".format(
+            case_name, case["extractor"], format_size(case["page_size"]),
+            case["time_median"] * 1000, format_size(case["peak_memory"]), comparison))
+
+        for strategy_name, strategy in case["strategies"].items():
+            print("{:<22}   {:<32} {:>8} {:>9.2f}ms {:>12}  {}".format(
+                "", strategy_name, "", strategy["time_median"] * 1000,
+                format_size(strategy["peak_memory"] or 0),
+                "ok" if strategy["succeeded"] else "failed"))
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Stud.IP page parsers")
+    parser.add_argument("--repeat", metavar="N", type=int, default=5,
+                        help="number of timed runs per case (Default is 5)")
+    parser.add_argument("--filter", metavar="TEXT", default=None,
+                        help="only run cases whose name contains TEXT")
+    parser.add_argument("--fixtures", metavar="DIR", default=None,
+                        help="use recorded pages named <case>.html from DIR instead of "
+                             "generated ones")
+    parser.add_argument("--write-fixtures", metavar="DIR", default=None,
+                        help="write the generated pages to DIR and exit")
+    parser.add_argument("--output", metavar="FILE", default=None,
+                        help="save the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", default=None,
+                        help="compare with the JSON results of an earlier run")
+    parser.add_argument("--threshold", metavar="RATIO", type=float, default=1.25,
+                        help="slowdown compared to --compare that counts as regression "
+                             "(Default is 1.25)")
+    args = parser.parse_args()
+
+    cases = [case for case in CASES if not args.filter or args.filter in case[0]]
+
+    if args.write_fixtures:
+        os.makedirs(args.write_fixtures, exist_ok=True)
+        for case_name, _, _, generate in cases:
+            with open(os.path.join(args.write_fixtures, case_name + ".html"), "w",
+                      encoding="utf-8") as file:
+                file.write(generate())
+        return 0
+
+    results = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "time": int(time.time()),
+        "repeat": args.repeat,
+        "cases": {}
+    }
+
+    for case_name, extractor, func, generate in cases:
+        html = load_page(case_name, generate, args.fixtures)
+
+        case = measure_case(func, html, args.repeat)
+        case["extractor"] = extractor
+        case["page_size"] = len(html.encode("utf-8"))
+        results["cases"][case_name] = case
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+    regressions = print_results(results, baseline, args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+    if regressions:
+        print("Slower than {}: {}".format(args.compare, ", ".join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
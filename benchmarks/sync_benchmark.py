@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""Runs complete syncs against the mock server and measures them
+
+Every client is run in a fresh directory, first cold (nothing downloaded yet), then warm
+(incremental sync without changes) and warm with --full. Each run is a separate studip-sync
+process, so the module level config of studip-sync is set up like in real use. For every run
+the wall time, the CPU time of the sync process and the requests and bytes served by the mock
+server are reported.
+
+    python benchmarks/sync_benchmark.py --courses 20 --files 10 --latency 0.01 --output sync.json
+"""
+
+import argparse
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# pylint: disable=wrong-import-position
+from benchmarks import mock_server
+
+REPOSITORY_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUDIP_SYNC = os.path.join(REPOSITORY_DIR, "studip_sync.py")
+
+CLIENTS = {
+    "api": [],
+    "html": ["--disable-api"],
+    "old": ["--old"]
+}
+
+PHASES = [
+    # name, extra arguments
+    ("cold", []),
+    ("warm", []),
+    ("warm-full", ["--full"])
+]
+
+
+def server_stats(base_url, reset=False):
+    request = urllib.request.Request(base_url + "_stats", method="POST" if reset else "GET")
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read().decode())
+
+
+def write_config(workdir, base_url, extra_config):
+    config_dir = os.path.join(workdir, "config")
+    os.makedirs(config_dir, exist_ok=True)
+
+    config = {
+        "user": {"login": "benchmark", "password": "benchmark"},
+        "base_url": base_url,
+        "files_destination": os.path.join(workdir, "files"),
+        "media_destination": os.path.join(workdir, "media")
+    }
+    config.update(extra_config)
+
+    config_file = os.path.join(config_dir, "config.json")
+    with open(config_file, "w") as file:
+        json.dump(config, file)
+
+    return config_file
+
+
+def run_sync(config_file, arguments, base_url, log_file):
+    server_stats(base_url, reset=True)
+
+    usage_before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+
+    env = dict(os.environ)
+    env["XDG_CONFIG_HOME"] = os.path.dirname(config_file)
+
+    with open(log_file, "a") as log:
+        log.write("$ studip_sync.py {}\n".format(" ".join(arguments)))
+        log.flush()
+        returncode = subprocess.call([sys.executable, STUDIP_SYNC, "-c", config_file] + arguments,
+                                     stdout=log, stderr=subprocess.STDOUT, env=env,
+                                     cwd=REPOSITORY_DIR)
+
+    wall_time = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    stats = server_stats(base_url)
+
+    return {
+        "returncode": returncode,
+        "wall_time": wall_time,
+        "cpu_time": (usage_after.ru_utime - usage_before.ru_utime) +
+                    (usage_after.ru_stime - usage_before.ru_stime),
+        "requests": stats["requests"],
+        "bytes": stats["bytes"],
+        "not_modified": stats["not_modified"],
+        "errors": stats["errors"]
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark complete syncs against a mock server")
+    mock_server.add_data_arguments(parser)
+    parser.add_argument("--clients", default=",".join(CLIENTS),
+                        help="comma separated clients to run (Default is {})".format(
+                            ",".join(CLIENTS)))
+    parser.add_argument("--args", default="",
+                        help="additional arguments for every sync, e.g. \"--jobs 4\"")
+    parser.add_argument("--config", default="{}",
+                        help="additional config file options as JSON")
+    parser.add_argument("--keep", action="store_true",
+                        help="keep the synced files and logs")
+    parser.add_argument("--output", metavar="FILE", default=None,
+                        help="save the results as JSON")
+    args = parser.parse_args()
+
+    data = mock_server.data_from_args(args)
+    server = mock_server.serve(data, latency=args.latency, error_rate=args.error_rate,
+                               seed=args.seed)
+    base_url = "http://{}:{}/".format(*server.server_address)
+
+    results = {
+        "parameters": vars(args),
+        "total_files": len(data.files),
+        "total_bytes": sum(file["size"] for file in data.files.values()),
+        "runs": []
+    }
+
+    basedir = tempfile.mkdtemp(prefix="studip-sync-benchmark")
+
+    print("{} files with {:.1f} MiB in {} courses, logs in {}".format(
+        results["total_files"], results["total_bytes"] / 1024 / 1024, len(data.courses),
+        basedir))
+    print("{:<8} {:<10} {:>6} {:>9} {:>9} {:>9} {:>11} {:>6}".format(
+        "client", "phase", "status", "wall", "cpu", "requests", "bytes", "304"))
+
+    try:
+        for client in args.clients.split(","):
+            workdir = os.path.join(basedir, client)
+            config_file = write_config(workdir, base_url, json.loads(args.config))
+            log_file = os.path.join(basedir, client + ".log")
+
+            for phase, phase_arguments in PHASES:
+                arguments = CLIENTS[client] + phase_arguments + args.args.split()
+                run = run_sync(config_file, arguments, base_url, log_file)
+                run["client"] = client
+                run["phase"] = phase
+                results["runs"].append(run)
+
+                print("{:<8} {:<10} {:>6} {:>8.2f}s {:>8.2f}s {:>9} {:>7.1f} MiB {:>6}".format(
+                    client, phase, run["returncode"], run["wall_time"], run["cpu_time"],
+                    run["requests"], run["bytes"] / 1024 / 1024, run["not_modified"]))
+    finally:
+        server.shutdown()
+        if not args.keep:
+            shutil.rmtree(basedir)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=4)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -19,6 +19,9 @@ setup(
         'lxml'
     ],
     extras_require={
+        "async": [
+            "aiohttp"
+        ],
         "google-tasks": [
             "google-api-python-client",
             "google-auth-httplib2",
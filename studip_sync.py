@@ -23,12 +23,19 @@ if ARGS.disable_plugin:
     with PluginHelper(ARGS.disable_plugin) as plugin_helper:
         exit(plugin_helper.disable())
 
-if ARGS.old:
-    from studip_sync.studip_sync import StudipSync
-    with StudipSync() as s:
-        exit(s.sync(ARGS.full, ARGS.recent))
-else:
-    from studip_sync.studip_rsync import StudIPRSync
-    with StudIPRSync() as s:
-        exit(s.sync(ARGS.full, ARGS.recent, not ARGS.disable_api))
+from studip_sync.metrics import METRICS
+from studip_sync.profiler import PROFILER
+from studip_sync.progress import PROGRESS
+
+with METRICS.export(ARGS.metrics_file, ARGS.metrics_port), PROFILER.profile(ARGS.profile), \
+        PROGRESS.show(ARGS.progress):
+    if ARGS.old:
+        from studip_sync.studip_sync import StudipSync
+        with StudipSync() as s:
+            exit(s.sync(ARGS.full, ARGS.recent))
+    else:
+        from studip_sync.studip_rsync import StudIPRSync
+        with StudIPRSync() as s:
+            exit(s.sync(ARGS.full, ARGS.recent, not ARGS.disable_api, ARGS.jobs,
+                        ARGS.file_jobs, ARGS.schedule))
 
@@ -1,5 +1,15 @@
 import argparse
 
+from studip_sync.progress import PROGRESS_AUTO, PROGRESS_MODES
+from studip_sync.scheduler import parse_policies, SCHEDULE_POLICIES
+
+
+def _schedule_policies(value):
+    try:
+        return parse_policies(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description="Synchronize Stud.IP files")
@@ -31,6 +41,38 @@ def parse_args():
     parser.add_argument("--disable-api", action="store_true",
                         help="don't use the StudIP API endpoint to download and discover files")
 
+    parser.add_argument("-j", "--jobs", metavar="N", type=int, default=1,
+                        help="number of courses to synchronize concurrently (Default is 1)")
+
+    parser.add_argument("--file-jobs", metavar="N", type=int, default=1,
+                        help="number of files to download concurrently per course (Default is 1)")
+
+    parser.add_argument("--schedule", metavar="POLICIES", type=_schedule_policies, default=None,
+                        help="download the files and media of all courses from one queue, "
+                             "ordered by a comma separated list of policies ({})".format(
+                                 ", ".join(SCHEDULE_POLICIES)))
+
+    parser.add_argument("--rebuild-manifest", action="store_true",
+                        help="forget the index of downloaded files and check every file on disk")
+
+    parser.add_argument("--change-list", metavar="FILE", default=None,
+                        help="write the files changed by the older sync client to FILE as JSON")
+
+    parser.add_argument("--metrics-file", metavar="FILE", default=None,
+                        help="write metrics of the sync to FILE in the OpenMetrics text format")
+
+    parser.add_argument("--metrics-port", metavar="PORT", type=int, default=None,
+                        help="serve the metrics on http://127.0.0.1:PORT/metrics while syncing")
+
+    parser.add_argument("--progress", choices=PROGRESS_MODES, default=PROGRESS_AUTO,
+                        help="show the progress of the downloads in a status line (tty), as a "
+                             "periodic summary (summary) or not at all (none). The default "
+                             "picks tty if the output is a terminal")
+
+    parser.add_argument("--profile", metavar="FILE", default=None,
+                        help="measure where the time of the sync goes, print the slowest steps "
+                             "and write a Chrome trace to FILE")
+
     # PLUGINS
     parser.add_argument("--enable-plugin", metavar="PLUGIN",
                         help="enables and configures a plugin")
@@ -0,0 +1,113 @@
+from http.cookies import Morsel
+
+try:
+    import aiohttp
+    import yarl
+except ImportError:
+    aiohttp = None
+
+from studip_sync.http_cache import HTTPCache
+from studip_sync.metrics import METRICS
+
+
+def is_available():
+    """Returns whether the optional aiohttp dependency (extra "async") is installed"""
+    return aiohttp is not None
+
+
+class AsyncResponse(object):
+    """Completely read aiohttp response with the attributes of a requests response that the
+    checks and parsers of Session use"""
+
+    def __init__(self, status_code, headers, content, encoding=None):
+        super(AsyncResponse, self).__init__()
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+        self.encoding = encoding or "utf-8"
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+
+class AsyncSession(object):
+    """asyncio client for listing the folders of a course, it is not a replacement of Session
+
+    It is based on aiohttp and only offers the folder listings. The login, the course list and
+    all downloads stay with Session, whose URL helper, cache and cookies it takes over. Any number
+    of coroutines can use it from the thread running the event loop, while at most max_requests
+    requests are in flight at the same time.
+    """
+
+    def __init__(self, session, max_requests):
+        super(AsyncSession, self).__init__()
+        if aiohttp is None:
+            raise RuntimeError("AsyncSession needs aiohttp, install studip-sync[async]")
+
+        self.session = session
+        self.url = session.url
+        self.max_requests = max_requests
+        self.client = None
+
+    async def __aenter__(self):
+        # The cookies are sent to the base url, even if it is an IP address
+        cookie_jar = aiohttp.CookieJar(unsafe=True)
+        self._copy_cookies(cookie_jar)
+
+        self.client = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_requests),
+            cookie_jar=cookie_jar,
+            headers={"User-Agent": self.session.session.headers["User-Agent"]},
+            # Use the same proxies as requests
+            trust_env=True)
+        return self
+
+    def _copy_cookies(self, cookie_jar):
+        """Copies the cookies of the Session that belong to the base url, with domain and path
+
+        Cookies of other hosts, e.g. of the identity provider of the login, are left out.
+        """
+        base_url = yarl.URL(self.url.base_url)
+
+        for cookie in self.session.session.cookies:
+            morsel = Morsel()
+            morsel.set(cookie.name, cookie.value, cookie.value)
+            morsel["path"] = cookie.path
+
+            if cookie.domain_specified:
+                # The jar ignores cookies whose domain doesn't match the base url
+                morsel["domain"] = cookie.domain
+            elif cookie.domain != base_url.host:
+                continue
+
+            cookie_jar.update_cookies({cookie.name: morsel}, response_url=base_url)
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.client.close()
+
+    async def get(self, url, params=None, headers=None):
+        async with self.client.get(url, params=params, headers=headers) as response:
+            result = AsyncResponse(response.status, response.headers, await response.read(),
+                                   response.charset)
+
+        METRICS.count_request(str(response.url), result.status_code)
+        return result
+
+    async def get_parsed(self, url, parse, check_response, params=None, variant=""):
+        """Same as Session.get_parsed(), including the cache"""
+        key, entry = self.session.cache_entry(url, params, variant)
+
+        response = await self.get(url, params, HTTPCache.request_headers(entry))
+        return self.session.parse_response(response, key, entry, parse, check_response)
+
+    async def get_files_index(self, course_id, folder_id=None):
+        return await self.get_parsed(**self.session.files_index_request(course_id, folder_id))
+
+    async def get_files_index_from_api(self, course_id, folder_id=None):
+        return await self.get_parsed(**self.session.files_index_api_request(course_id,
+                                                                              folder_id))
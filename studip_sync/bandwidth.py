@@ -0,0 +1,243 @@
+import threading
+import time
+from datetime import datetime
+
+from studip_sync.metrics import METRICS
+
+BANDWIDTH_TOTAL = "total"
+BANDWIDTH_FILES = "files"
+BANDWIDTH_MEDIA = "media"
+BANDWIDTH_KINDS = (BANDWIDTH_TOTAL, BANDWIDTH_FILES, BANDWIDTH_MEDIA)
+
+# Smallest read of a throttled download, so that low rates don't end up in tiny reads
+MIN_CHUNK_SIZE = 16 * 1024
+# How often the schedule is checked for a change of the limits
+SCHEDULE_INTERVAL = 10
+
+
+def format_size(size):
+    for unit in ("B", "KiB", "MiB"):
+        if size < 1024:
+            return "{:.1f} {}".format(size, unit)
+        size /= 1024
+
+    return "{:.1f} GiB".format(size)
+
+
+def parse_time_of_day(value):
+    """Returns the minutes since midnight of a time like "08:30" """
+    try:
+        hours, minutes = value.split(":")
+        hours, minutes = int(hours), int(minutes)
+    except (AttributeError, ValueError):
+        raise ValueError("Invalid time of day: {}".format(value))
+
+    if not 0 <= hours <= 24 or not 0 <= minutes < 60:
+        raise ValueError("Invalid time of day: {}".format(value))
+
+    return hours * 60 + minutes
+
+
+def parse_limits(config):
+    limits = {}
+
+    for kind in BANDWIDTH_KINDS:
+        rate = config.get(kind)
+        if rate is None:
+            continue
+
+        if not isinstance(rate, int) or rate < 0:
+            raise ValueError("Invalid bandwidth limit for {}: {}".format(kind, rate))
+
+        limits[kind] = rate
+
+    return limits
+
+
+class TokenBucket(object):
+    """Token bucket which refills with rate bytes per second and holds up to one second of tokens
+
+    Consumers may take more tokens than there are and then have to wait until the debt is paid
+    off, so all threads drawing from the same bucket together stay at its rate. A rate of 0 or
+    None means no limit.
+    """
+
+    def __init__(self, rate=None):
+        super(TokenBucket, self).__init__()
+        self.rate = rate
+        self.tokens = 0
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        if self.rate:
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def set_rate(self, rate):
+        with self.lock:
+            self._refill(time.monotonic())
+            self.rate = rate
+            if not rate:
+                self.tokens = 0
+
+    def reserve(self, amount):
+        """Takes amount tokens and returns how many seconds to wait before using them"""
+        with self.lock:
+            if not self.rate:
+                return 0
+
+            self._refill(time.monotonic())
+            self.tokens -= amount
+
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+
+class BandwidthLimiter(object):
+    """Global download rate limits for all transfers of a sync
+
+    limits holds the rates in bytes per second for "total", "files" and "media", each of them is
+    optional. Every entry of schedule additionally has a "from" and "to" time of day and replaces
+    the limits while it is active. Downloads of files draw from the "files" and the "total"
+    bucket, media from the "media" and the "total" bucket.
+    """
+
+    def __init__(self, limits=None, schedule=None):
+        super(BandwidthLimiter, self).__init__()
+        self.limits = limits or {}
+        self.schedule = schedule or []
+        self.buckets = {kind: TokenBucket() for kind in BANDWIDTH_KINDS}
+        self.lock = threading.Lock()
+        self.checked = None
+
+    @staticmethod
+    def from_config(config):
+        """Returns a limiter for the "bandwidth" config option or None if nothing is limited"""
+        if not config:
+            return None
+
+        schedule = []
+        for entry in config.get("schedule", []):
+            start = parse_time_of_day(entry.get("from"))
+            end = parse_time_of_day(entry.get("to"))
+            schedule.append((start, end, parse_limits(entry)))
+
+        limits = parse_limits(config)
+        if not any(limits.values()) and not schedule:
+            return None
+
+        return BandwidthLimiter(limits, schedule)
+
+    def current_limits(self, now=None):
+        now = now or datetime.now()
+        minutes = now.hour * 60 + now.minute
+
+        for start, end, limits in self.schedule:
+            # A window like 22:00 - 06:00 goes past midnight
+            if start <= end and start <= minutes < end or \
+                    start > end and (minutes >= start or minutes < end):
+                return limits
+
+        return self.limits
+
+    def _update_rates(self):
+        now = time.monotonic()
+
+        with self.lock:
+            if self.checked is not None and now - self.checked < SCHEDULE_INTERVAL:
+                return
+            self.checked = now
+
+        limits = self.current_limits()
+        for kind, bucket in self.buckets.items():
+            bucket.set_rate(limits.get(kind))
+
+    def chunk_size(self, kind, default=None):
+        """Returns the size of a single read, so that throttled transfers flow evenly"""
+        self._update_rates()
+
+        rates = [self.buckets[name].rate for name in (BANDWIDTH_TOTAL, kind)
+                 if self.buckets[name].rate]
+        if not rates:
+            return default
+
+        chunk_size = max(MIN_CHUNK_SIZE, min(rates) // 10)
+
+        return chunk_size if default is None else min(default, chunk_size)
+
+    def consume(self, kind, amount):
+        """Waits until amount bytes of kind may be transferred"""
+        self._update_rates()
+
+        delay = max(self.buckets[BANDWIDTH_TOTAL].reserve(amount),
+                    self.buckets[kind].reserve(amount))
+        if delay > 0:
+            time.sleep(delay)
+
+
+class Transfer(object):
+    """Measures the throughput of a single download
+
+    name and expected_size are optional and only used to show the progress of the download.
+    """
+
+    def __init__(self, name=None, expected_size=None):
+        super(Transfer, self).__init__()
+        self.name = name
+        self.expected_size = expected_size
+        self.size = 0
+        self.started = time.monotonic()
+        self.finished = None
+
+    def add(self, amount):
+        self.size += amount
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    @property
+    def duration(self):
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def throughput(self):
+        duration = self.duration
+        return self.size / duration if duration > 0 else 0
+
+    def __str__(self):
+        return "{} at {}/s".format(format_size(self.size), format_size(self.throughput))
+
+
+class TransferStream(object):
+    """Read-only stream wrapper which measures and optionally throttles the wrapped stream
+
+    Every read is also reported to progress, if it is given.
+    """
+
+    def __init__(self, stream, limiter=None, kind=BANDWIDTH_FILES, progress=None):
+        super(TransferStream, self).__init__()
+        self.stream = stream
+        self.limiter = limiter
+        self.kind = kind
+        self.progress = progress
+        self.transfer = Transfer()
+
+    def read(self, size=-1):
+        if self.limiter is not None:
+            chunk_size = self.limiter.chunk_size(self.kind)
+            if chunk_size is not None and (size is None or size < 0 or size > chunk_size):
+                size = chunk_size
+
+        data = self.stream.read(size)
+
+        if data:
+            self.transfer.add(len(data))
+            METRICS.inc("studip_sync_transferred_bytes", len(data), kind=self.kind)
+            if self.progress is not None:
+                self.progress.advance(len(data))
+            if self.limiter is not None:
+                self.limiter.consume(self.kind, len(data))
+        else:
+            self.transfer.finish()
+
+        return data
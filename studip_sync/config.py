@@ -5,9 +5,11 @@ import subprocess
 
 from studip_sync import get_config_file
 from studip_sync.arg_parser import ARGS
+from studip_sync.bandwidth import BandwidthLimiter
 from studip_sync.config_creator import ConfigCreator
 from studip_sync.constants import URL_BASEURL_DEFAULT, AUTHENTICATION_TYPE_DEFAULT, \
-    AUTHENTICATION_TYPE_DATA_DEFAULT, AUTHENTICATION_TYPES
+    AUTHENTICATION_TYPE_DATA_DEFAULT, AUTHENTICATION_TYPES, HTTP_CACHE_SIZE_DEFAULT, \
+    MEDIA_URL_TTL_DEFAULT
 from studip_sync.helpers import JSONConfig, ConfigError
 
 
@@ -40,6 +42,11 @@ class Config(JSONConfig):
         if self.auth_type not in AUTHENTICATION_TYPES:
             raise ConfigError("Invalid auth type!")
 
+        try:
+            BandwidthLimiter.from_config(self.bandwidth)
+        except (AttributeError, ValueError) as e:
+            raise ConfigError("Invalid bandwidth limits: " + str(e))
+
     @property
     def last_sync(self):
         if not self.config:
@@ -167,6 +174,34 @@ class Config(JSONConfig):
 
         return self.config.get("use_new_file_structure", False)
 
+    @property
+    def deduplicate_files(self):
+        if not self.config:
+            return False
+
+        return self.config.get("deduplicate_files", False)
+
+    @property
+    def http_cache_size(self):
+        if not self.config:
+            return HTTP_CACHE_SIZE_DEFAULT
+
+        return self.config.get("http_cache_size", HTTP_CACHE_SIZE_DEFAULT)
+
+    @property
+    def media_url_ttl(self):
+        if not self.config:
+            return MEDIA_URL_TTL_DEFAULT
+
+        return self.config.get("media_url_ttl", MEDIA_URL_TTL_DEFAULT)
+
+    @property
+    def bandwidth(self):
+        if not self.config:
+            return None
+
+        return self.config.get("bandwidth")
+
 
 try:
     CONFIG = Config()
@@ -4,6 +4,17 @@ from studip_sync.logins.shibboleth import ShibbolethLogin
 
 URL_BASEURL_DEFAULT = "https://studip.uni-goettingen.de"
 CONFIG_FILENAME = "config.json"
+MANIFEST_FILENAME = "manifest.sqlite"
+SYNC_STATE_FILENAME = "sync_state.sqlite"
+HTTP_CACHE_FILENAME = "http_cache.sqlite"
+COOKIES_FILENAME = "cookies.json"
+HASH_CACHE_FILENAME = "hash_cache.sqlite"
+CRC_INDEX_FILENAME = "crc_index.sqlite"
+OBJECT_STORE_DIRNAME = ".studip-sync-objects"
+MEDIA_INDEX_FILENAME = "media_index.sqlite"
+HTTP_CACHE_SIZE_DEFAULT = 64 * 1024 * 1024
+MEDIA_URL_TTL_DEFAULT = 6 * 60 * 60
+PLUGIN_QUEUE_SIZE = 256
 LOGIN_PRESETS = [
     LoginPreset(name="University of Göttingen", base_url="https://studip.uni-goettingen.de",
                 auth_type="general", auth_data={}),
@@ -0,0 +1,35 @@
+from studip_sync.helpers import SQLiteDatabase
+
+
+class CRCIndex(SQLiteDatabase):
+    """Remembers the CRC32 and size of every zip member that was synced by the older client
+
+    Besides the member name, every entry stores the path of the file relative to the course
+    directory and the size and modification time the file had after it was synced. A member is
+    only unchanged as long as both the archive and the file on disk still match the entry.
+    """
+
+    def _create_tables(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS members ("
+                           "course_id TEXT NOT NULL, "
+                           "name TEXT NOT NULL, "
+                           "crc INTEGER NOT NULL, "
+                           "size INTEGER NOT NULL, "
+                           "path TEXT NOT NULL, "
+                           "mtime_ns INTEGER NOT NULL, "
+                           "PRIMARY KEY (course_id, name))")
+
+    def get_course(self, course_id):
+        """Returns the entries of a course by member name"""
+        entries = self.fetch_all("SELECT * FROM members WHERE course_id = ?", (course_id,))
+
+        return {entry["name"]: entry for entry in entries}
+
+    def replace_course(self, course_id, entries):
+        """Replaces all entries of a course with the (name, crc, size, path, mtime_ns) entries"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM members WHERE course_id = ?", (course_id,))
+            self.connection.executemany("INSERT INTO members "
+                                        "(course_id, name, crc, size, path, mtime_ns) "
+                                        "VALUES (?, ?, ?, ?, ?, ?)",
+                                        [(course_id,) + tuple(entry) for entry in entries])
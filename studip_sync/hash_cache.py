@@ -0,0 +1,56 @@
+import hashlib
+
+from studip_sync.helpers import SQLiteDatabase
+
+HASH_BUFSIZE = 1024 * 1024
+
+
+def hash_file(path):
+    content_hash = hashlib.sha256()
+
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(HASH_BUFSIZE)
+            if not chunk:
+                break
+            content_hash.update(chunk)
+
+    return content_hash.hexdigest()
+
+
+class HashCache(SQLiteDatabase):
+    """Persistent cache of the SHA-256 hashes of local files
+
+    An entry is only valid as long as the size and modification time of the file are unchanged,
+    otherwise the file is hashed again.
+    """
+
+    def _create_tables(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS hashes ("
+                           "path TEXT PRIMARY KEY, "
+                           "size INTEGER NOT NULL, "
+                           "mtime_ns INTEGER NOT NULL, "
+                           "hash TEXT NOT NULL)")
+
+    def get(self, path, stat):
+        entry = self.fetch_one("SELECT * FROM hashes WHERE path = ?", (path,))
+
+        if entry is None or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            return None
+
+        return entry["hash"]
+
+    def update_many(self, entries):
+        """Writes all (path, stat, hash) entries in a single transaction"""
+        self.execute_many("INSERT OR REPLACE INTO hashes (path, size, mtime_ns, hash) "
+                          "VALUES (?, ?, ?, ?)",
+                          [(path, stat.st_size, stat.st_mtime_ns, content_hash)
+                           for path, stat, content_hash in entries])
+
+    def hash(self, path, stat):
+        """Returns the hash of path, from the cache if possible, and whether it was computed"""
+        content_hash = self.get(path, stat)
+        if content_hash is not None:
+            return content_hash, False
+
+        return hash_file(path), True
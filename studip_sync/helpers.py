@@ -1,5 +1,8 @@
+import io
 import json
 import os
+import sqlite3
+import threading
 
 
 class ConfigError(Exception):
@@ -32,3 +35,103 @@ class JSONConfig(object):
         with open(path, "w") as config_file:
             print("Writing new config to '{}'".format(path))
             json.dump(config, config_file, ensure_ascii=False, indent=4)
+
+
+class SQLiteDatabase(object):
+    """Thread-safe SQLite database used for the persistent indexes in the config dir"""
+
+    def __init__(self, path):
+        super(SQLiteDatabase, self).__init__()
+        self.path = path
+        self.lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self._create_tables(self.connection)
+
+    def _create_tables(self, connection):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    def fetch_one(self, query, parameters=()):
+        with self.lock:
+            row = self.connection.execute(query, parameters).fetchone()
+
+        return dict(row) if row else None
+
+    def fetch_all(self, query, parameters=()):
+        with self.lock:
+            rows = self.connection.execute(query, parameters).fetchall()
+
+        return [dict(row) for row in rows]
+
+    def execute(self, query, parameters=()):
+        with self.lock, self.connection:
+            self.connection.execute(query, parameters)
+
+    def execute_many(self, query, parameters):
+        """Executes the query for all parameters in a single transaction"""
+        with self.lock, self.connection:
+            self.connection.executemany(query, parameters)
+
+
+class OrderedOutput(object):
+    """File-like stdout replacement which buffers the output of worker threads
+
+    Output written inside of capture() is kept back until release() is called for the same key,
+    so that concurrently running jobs can still be printed in a stable order.
+    """
+
+    def __init__(self, stream):
+        super(OrderedOutput, self).__init__()
+        self.stream = stream
+        self.local = threading.local()
+        self.buffers = {}
+        self.lock = threading.Lock()
+
+    def write(self, text):
+        buffer = getattr(self.local, "buffer", None)
+
+        if buffer is None:
+            return self.stream.write(text)
+
+        return buffer.write(text)
+
+    def flush(self):
+        if getattr(self.local, "buffer", None) is None:
+            self.stream.flush()
+
+    def capture(self, key, func, *args, **kwargs):
+        buffer = io.StringIO()
+
+        with self.lock:
+            self.buffers[key] = buffer
+
+        self.local.buffer = buffer
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.local.buffer = None
+
+    def release(self, key):
+        with self.lock:
+            buffer = self.buffers.pop(key, None)
+
+        if buffer is not None:
+            self.stream.write(buffer.getvalue())
+            self.stream.flush()
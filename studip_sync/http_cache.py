@@ -0,0 +1,110 @@
+import hashlib
+import json
+import time
+import urllib.parse
+
+from studip_sync.helpers import SQLiteDatabase
+
+
+class HTTPCache(SQLiteDatabase):
+    """On-disk cache of parsed pages together with their HTTP validators
+
+    Instead of the raw responses only the parsed results are stored, so a page that didn't change
+    is neither downloaded (304 Not Modified) nor parsed again (same content hash). Once the
+    results take up more than max_size bytes, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path, max_size):
+        super(HTTPCache, self).__init__(path)
+        self.max_size = max_size
+
+        total_size = self.fetch_one("SELECT SUM(size) AS total_size FROM entries")
+        self.total_size = total_size["total_size"] or 0
+
+    def _create_tables(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS entries ("
+                           "key TEXT PRIMARY KEY, "
+                           "etag TEXT, "
+                           "last_modified TEXT, "
+                           "content_hash TEXT NOT NULL, "
+                           "result TEXT NOT NULL, "
+                           "size INTEGER NOT NULL, "
+                           "last_used REAL NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)")
+
+    @staticmethod
+    def key(url, params=None, variant=""):
+        if params:
+            url = url + "?" + urllib.parse.urlencode(sorted(params.items()))
+
+        return "{} {}".format(variant, url)
+
+    @staticmethod
+    def content_hash(content):
+        return hashlib.sha256(content).hexdigest()
+
+    def get(self, key):
+        entry = self.fetch_one("SELECT * FROM entries WHERE key = ?", (key,))
+
+        if entry is None:
+            return None
+
+        entry["result"] = json.loads(entry["result"])
+        return entry
+
+    @staticmethod
+    def request_headers(entry):
+        headers = {}
+
+        if entry is None:
+            return headers
+
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+
+        return headers
+
+    def touch(self, key, response=None):
+        if response is None:
+            self.execute("UPDATE entries SET last_used = ? WHERE key = ?", (time.time(), key))
+        else:
+            self.execute("UPDATE entries SET last_used = ?, etag = ?, last_modified = ? "
+                         "WHERE key = ?", (time.time(), response.headers.get("ETag"),
+                                           response.headers.get("Last-Modified"), key))
+
+    def put(self, key, response, content_hash, result):
+        result = json.dumps(result)
+        size = len(result)
+
+        with self.lock, self.connection:
+            old_entry = self.connection.execute("SELECT size FROM entries WHERE key = ?",
+                                                (key,)).fetchone()
+            if old_entry is not None:
+                self.total_size -= old_entry["size"]
+
+            self.connection.execute("INSERT OR REPLACE INTO entries "
+                                    "(key, etag, last_modified, content_hash, result, size, "
+                                    "last_used) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                    (key, response.headers.get("ETag"),
+                                     response.headers.get("Last-Modified"), content_hash, result,
+                                     size, time.time()))
+            self.total_size += size
+
+            if self.total_size > self.max_size:
+                self._evict()
+
+    def _evict(self):
+        rows = self.connection.execute("SELECT key, size FROM entries ORDER BY last_used ASC")
+
+        evicted = []
+        for row in rows:
+            if self.total_size <= self.max_size:
+                break
+
+            evicted.append((row["key"],))
+            self.total_size -= row["size"]
+
+        self.connection.executemany("DELETE FROM entries WHERE key = ?", evicted)
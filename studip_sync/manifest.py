@@ -0,0 +1,48 @@
+from studip_sync.helpers import SQLiteDatabase
+
+
+class Manifest(SQLiteDatabase):
+    """Persistent index of the downloaded files, keyed by their Stud.IP file id
+
+    Every entry stores the chdate and size of the file at the time it was downloaded, the local
+    path it was saved to and the SHA-256 hash of its content. Entries written while rebuilding
+    the index from disk have no hash. The content id is the id of the underlying Stud.IP file,
+    which is shared by all copies of a file in different courses.
+    """
+
+    def _create_tables(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS files ("
+                           "file_id TEXT PRIMARY KEY, "
+                           "path TEXT NOT NULL, "
+                           "chdate INTEGER NOT NULL, "
+                           "size INTEGER NOT NULL, "
+                           "hash TEXT, "
+                           "content_id TEXT)")
+
+        # Manifests of older versions don't have the content id yet
+        columns = [row["name"] for row in connection.execute("PRAGMA table_info(files)")]
+        if "content_id" not in columns:
+            connection.execute("ALTER TABLE files ADD COLUMN content_id TEXT")
+
+        connection.execute("CREATE INDEX IF NOT EXISTS files_content_id ON files (content_id)")
+
+    def get(self, file_id):
+        return self.fetch_one("SELECT * FROM files WHERE file_id = ?", (file_id,))
+
+    def find_content(self, content_id, size, chdate):
+        """Returns an entry with a hash for the same content that is at least as new as chdate"""
+        return self.fetch_one("SELECT * FROM files WHERE content_id = ? AND size = ? AND "
+                              "chdate >= ? AND hash IS NOT NULL ORDER BY chdate DESC",
+                              (content_id, size, chdate))
+
+    def update(self, file_id, path, chdate, size, content_hash=None, content_id=None):
+        self.update_many([(file_id, path, chdate, size, content_hash, content_id)])
+
+    def update_many(self, entries):
+        """Writes all (file_id, path, chdate, size, hash, content_id) entries at once"""
+        self.execute_many("INSERT OR REPLACE INTO files "
+                          "(file_id, path, chdate, size, hash, content_id) "
+                          "VALUES (?, ?, ?, ?, ?, ?)", entries)
+
+    def clear(self):
+        self.execute("DELETE FROM files")
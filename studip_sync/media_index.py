@@ -0,0 +1,108 @@
+import os
+import time
+
+from studip_sync.helpers import SQLiteDatabase
+
+MEDIA_STATE_PARTIAL = "partial"
+MEDIA_STATE_COMPLETE = "complete"
+
+
+def find_media_hash(filename, media_hashes):
+    """Returns the hash of a media file named "{name}-{hash}.{ext}" or "{hash}-{name}.{ext}" """
+    filename_split = filename.split("-")
+
+    for candidate in (filename_split[-1].split(".")[0], filename_split[0]):
+        if candidate in media_hashes:
+            return candidate
+
+    return None
+
+
+def scan_media_dir(media_dir, filenames, media_hashes):
+    """Returns (hash, filename, size) of the files in media_dir that belong to media_hashes"""
+    entries = []
+
+    for filename in filenames:
+        media_hash = find_media_hash(filename, media_hashes)
+        if media_hash is not None:
+            entries.append((media_hash, filename,
+                            os.path.getsize(os.path.join(media_dir, filename))))
+
+    return entries
+
+
+class MediaIndex(SQLiteDatabase):
+    """Persistent index of the downloaded media files of every course, keyed by their hash
+
+    The index of a course is rebuilt from the file names in its media directory whenever the
+    directory is used for the first time. The download links found on the player pages are kept
+    for resolved_url_ttl seconds, so retries and later runs don't fetch the player pages again.
+    """
+
+    def __init__(self, path, resolved_url_ttl=0):
+        super(MediaIndex, self).__init__(path)
+        self.resolved_url_ttl = resolved_url_ttl
+
+    def _create_tables(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS media ("
+                           "course_id TEXT NOT NULL, "
+                           "hash TEXT NOT NULL, "
+                           "filename TEXT NOT NULL, "
+                           "size INTEGER NOT NULL, "
+                           "state TEXT NOT NULL, "
+                           "PRIMARY KEY (course_id, hash))")
+        connection.execute("CREATE TABLE IF NOT EXISTS media_dirs ("
+                           "course_id TEXT PRIMARY KEY, "
+                           "path TEXT NOT NULL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS resolved_urls ("
+                           "hash TEXT PRIMARY KEY, "
+                           "url TEXT NOT NULL, "
+                           "resolved_at INTEGER NOT NULL)")
+
+    def is_indexed(self, course_id, media_dir):
+        entry = self.fetch_one("SELECT path FROM media_dirs WHERE course_id = ?", (course_id,))
+
+        return entry is not None and entry["path"] == media_dir
+
+    def rebuild(self, course_id, media_dir, entries):
+        """Replaces the index of a course with the (hash, filename, size) entries found on disk"""
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM media WHERE course_id = ?", (course_id,))
+            self.connection.executemany("INSERT OR REPLACE INTO media "
+                                        "(course_id, hash, filename, size, state) "
+                                        "VALUES (?, ?, ?, ?, ?)",
+                                        [(course_id, media_hash, filename, size,
+                                          MEDIA_STATE_COMPLETE)
+                                         for media_hash, filename, size in entries])
+            self.connection.execute("INSERT OR REPLACE INTO media_dirs (course_id, path) "
+                                    "VALUES (?, ?)", (course_id, media_dir))
+
+    def get_course(self, course_id):
+        """Returns the entries of a course by hash"""
+        entries = self.fetch_all("SELECT * FROM media WHERE course_id = ?", (course_id,))
+
+        return {entry["hash"]: entry for entry in entries}
+
+    def update(self, course_id, media_hash, filename, size, state):
+        self.execute("INSERT OR REPLACE INTO media (course_id, hash, filename, size, state) "
+                     "VALUES (?, ?, ?, ?, ?)", (course_id, media_hash, filename, size, state))
+
+    def get_resolved_url(self, media_hash):
+        """Returns the cached download link of a media file or None if it expired"""
+        if not self.resolved_url_ttl:
+            return None
+
+        entry = self.fetch_one("SELECT url FROM resolved_urls WHERE hash = ? AND resolved_at > ?",
+                               (media_hash, int(time.time()) - self.resolved_url_ttl))
+
+        return entry["url"] if entry else None
+
+    def set_resolved_url(self, media_hash, url):
+        if not self.resolved_url_ttl:
+            return
+
+        self.execute("INSERT OR REPLACE INTO resolved_urls (hash, url, resolved_at) "
+                     "VALUES (?, ?, ?)", (media_hash, url, int(time.time())))
+
+    def forget_resolved_url(self, media_hash):
+        self.execute("DELETE FROM resolved_urls WHERE hash = ?", (media_hash,))
@@ -0,0 +1,198 @@
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+CONTENT_TYPE = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+
+COUNTER = "counter"
+GAUGE = "gauge"
+
+FAMILIES = {
+    # name: type, help
+    "studip_sync_requests": (COUNTER, "HTTP requests by endpoint type"),
+    "studip_sync_request_errors": (COUNTER, "HTTP error responses by endpoint type"),
+    "studip_sync_transferred_bytes": (COUNTER, "Downloaded bytes by kind"),
+    "studip_sync_files": (COUNTER, "Files and media files by result"),
+    "studip_sync_plugin_hook_errors": (COUNTER, "Failed plugin hooks by plugin and hook"),
+    "studip_sync_phase_duration_seconds": (COUNTER, "Time spent in each phase of the sync, "
+                                                    "summed up over concurrent courses"),
+    "studip_sync_run_duration_seconds": (GAUGE, "Duration of the last sync"),
+    "studip_sync_run_status": (GAUGE, "Exit status of the last sync"),
+    "studip_sync_run_timestamp_seconds": (GAUGE, "Time the last sync finished"),
+}
+
+# Endpoint types by the path of the requested url, the first match wins
+ENDPOINT_PATTERNS = [(endpoint, re.compile(pattern)) for endpoint, pattern in [
+    ("courses", r"dispatch\.php/my_courses"),
+    ("files_flat", r"dispatch\.php/course/files/flat"),
+    ("files_index", r"dispatch\.php/course/files"),
+    ("bulk_download", r"dispatch\.php/file/bulk/"),
+    ("api_folder", r"api\.php/(course/[^/]+/top_folder|folder/)"),
+    ("file_download", r"api\.php/file/[^/]+/download|sendfile\.php"),
+    ("media_list", r"mediacastplugin/media/index"),
+    ("media_player", r"mediacastplugin/media/player/"),
+    ("login_check", r"dispatch\.php/start"),
+]]
+
+
+def endpoint_type(url):
+    for endpoint, pattern in ENDPOINT_PATTERNS:
+        if pattern.search(url):
+            return endpoint
+
+    return "other"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace("\"", "\\\"")
+
+
+class Metrics(object):
+    """Counters and gauges of a sync, exported in the OpenMetrics text format
+
+    Updating a value only takes a lock and a dict lookup, so the counters can be updated for
+    every request and every downloaded chunk.
+    """
+
+    def __init__(self):
+        super(Metrics, self).__init__()
+        self.lock = threading.Lock()
+        self.values = {}
+        self.local = threading.local()
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+
+        with self.lock:
+            self.values[key] = value
+
+    @contextmanager
+    def timer(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.inc("studip_sync_phase_duration_seconds", time.perf_counter() - start,
+                     phase=phase)
+
+    @contextmanager
+    def endpoint(self, endpoint):
+        """Counts the requests of this thread as endpoint, whatever their url is"""
+        previous = getattr(self.local, "endpoint", None)
+        self.local.endpoint = endpoint
+        try:
+            yield
+        finally:
+            self.local.endpoint = previous
+
+    def count_response(self, response, *args, **kwargs):
+        """Response hook for requests.Session"""
+        self.count_request(response.request.url, response.status_code)
+
+    def count_request(self, url, status_code):
+        endpoint = getattr(self.local, "endpoint", None) or endpoint_type(url)
+
+        self.inc("studip_sync_requests", endpoint=endpoint)
+        if status_code >= 400:
+            self.inc("studip_sync_request_errors", endpoint=endpoint)
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items())
+
+        lines = []
+        for name, (metric_type, help_text) in FAMILIES.items():
+            samples = [(labels, value) for (sample_name, labels), value in values
+                       if sample_name == name]
+            if not samples:
+                continue
+
+            lines.append("# TYPE {} {}".format(name, metric_type))
+            lines.append("# HELP {} {}".format(name, help_text))
+
+            suffix = "_total" if metric_type == COUNTER else ""
+            for labels, value in samples:
+                label_text = ",".join("{}=\"{}\"".format(key, _escape(label_value))
+                                      for key, label_value in labels)
+                lines.append("{}{}{} {}".format(name, suffix,
+                                                "{" + label_text + "}" if label_text else "",
+                                                repr(float(value)) if isinstance(value, float)
+                                                else value))
+
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path):
+        """Writes the metrics atomically, so a collector never reads a partial file"""
+        temp_file = path + ".tmp"
+        with open(temp_file, "w") as file:
+            file.write(self.render())
+        os.replace(temp_file, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serves the metrics on http://host:port/metrics from a background thread"""
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+
+                body = metrics.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", CONTENT_TYPE)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    @contextmanager
+    def export(self, textfile=None, port=None):
+        """Records the duration and status of the sync inside the block and exports the metrics
+
+        The status is taken from the SystemExit raised by exit(status), any other exception
+        counts as status 1.
+        """
+        server = self.serve(port) if port else None
+        start = time.perf_counter()
+        status = 0
+
+        try:
+            yield
+        except SystemExit as e:
+            status = e.code if isinstance(e.code, int) else int(e.code is not None)
+            raise
+        except BaseException:
+            status = 1
+            raise
+        finally:
+            self.set("studip_sync_run_duration_seconds", time.perf_counter() - start)
+            self.set("studip_sync_run_status", status)
+            self.set("studip_sync_run_timestamp_seconds", int(time.time()))
+
+            if textfile:
+                self.write_textfile(textfile)
+
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+
+
+METRICS = Metrics()
@@ -0,0 +1,58 @@
+import os
+import shutil
+
+from studip_sync.session import PARTIAL_FILE_PREFIX
+
+
+class ObjectStore(object):
+    """Content-addressed store of downloaded files below the files destination
+
+    Every distinct content is kept once, named by its SHA-256 hash. The files in the course
+    directories are hard links to these objects, or copies if the file system doesn't support
+    hard links. Files must therefore be replaced instead of being edited in place.
+    """
+
+    def __init__(self, path):
+        super(ObjectStore, self).__init__()
+        self.path = path
+
+    def object_path(self, content_hash):
+        return os.path.join(self.path, content_hash[:2], content_hash)
+
+    def has(self, content_hash, size):
+        try:
+            return os.path.getsize(self.object_path(content_hash)) == size
+        except OSError:
+            return False
+
+    def add(self, file_path, content_hash):
+        """Adds a downloaded file to the store, or links it to the object with the same content"""
+        object_path = self.object_path(content_hash)
+
+        if os.path.exists(object_path):
+            self.link(content_hash, file_path)
+            return
+
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        try:
+            os.link(file_path, object_path)
+        except FileExistsError:
+            # Another download of the same content was faster
+            self.link(content_hash, file_path)
+        except OSError:
+            shutil.copyfile(file_path, object_path)
+
+    def link(self, content_hash, file_path):
+        """Replaces file_path with a link to the object"""
+        file_path_base, file_path_name = os.path.split(file_path)
+        temp_path = os.path.join(file_path_base, PARTIAL_FILE_PREFIX + file_path_name + ".link")
+
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+        try:
+            os.link(self.object_path(content_hash), temp_path)
+        except OSError:
+            shutil.copyfile(self.object_path(content_hash), temp_path)
+
+        os.replace(temp_path, file_path)
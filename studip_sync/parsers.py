@@ -4,6 +4,53 @@ from email.message import EmailMessage
 
 from functools import wraps
 from bs4 import BeautifulSoup
+import lxml.etree
+import lxml.html
+
+
+class Page(object):
+    """HTML page that is shared by all extractors of one response
+
+    The BeautifulSoup DOM and the lxml tree are only built on first use and at most once, so
+    extractors that only need a regex or XPath don't pay for a full soup.
+    """
+
+    def __init__(self, html):
+        super(Page, self).__init__()
+        self.html = html
+        self._soup = None
+        self._tree = None
+
+    def __str__(self):
+        return self.html
+
+    @property
+    def soup(self):
+        if self._soup is None:
+            self._soup = BeautifulSoup(self.html, 'lxml')
+
+        return self._soup
+
+    @property
+    def tree(self):
+        if self._tree is None:
+            # Parsing bytes avoids lxml rejecting strings with an encoding declaration
+            parser = lxml.html.HTMLParser(encoding="utf-8")
+            try:
+                self._tree = lxml.html.document_fromstring(self.html.encode("utf-8"),
+                                                           parser=parser)
+            except (lxml.etree.ParserError, ValueError) as e:
+                raise ParserError("Could not parse page: {}".format(e))
+
+        return self._tree
+
+
+def as_page(html):
+    if isinstance(html, Page):
+        return html
+
+    return Page(html)
+
 
 def log_html_on_exception():
     def decorator(func):
@@ -22,11 +69,11 @@ def log_html_on_exception():
 
 
 def try_parser_functions(html, func_attempts):
-    soup = BeautifulSoup(html, 'lxml')
+    page = as_page(html)
 
     for func_attempt in func_attempts:
         try:
-            return func_attempt(html, soup)
+            return func_attempt(page)
         except ParserError:
             continue
 
@@ -39,16 +86,16 @@ class ParserError(Exception):
 
 @log_html_on_exception()
 def extract_files_flat_last_edit(html):
-    def extract_json(_, s):
-        form = s.find('form', id="files_table_form")
+    def extract_json(page):
+        forms = page.tree.xpath('//form[@id="files_table_form"]')
 
-        if not form:
+        if not forms:
             raise ParserError("last_edit: files_table_form not found")
 
-        if "data-files" not in form.attrs:
+        if forms[0].get("data-files") is None:
             raise ParserError("last_edit: Missing data-files attribute in form")
 
-        form_data_files = json.loads(form.attrs["data-files"])
+        form_data_files = json.loads(forms[0].get("data-files"))
 
         file_timestamps = []
 
@@ -63,8 +110,8 @@ def extract_files_flat_last_edit(html):
         else:
             return 0
 
-    def extract_html_table(_, s):
-        for form in s.find_all('form'):
+    def extract_html_table(page):
+        for form in page.soup.find_all('form'):
             if 'action' in form.attrs:
                 tds = form.find('table').find('tbody').find_all('tr')[0].find_all('td')
                 if len(tds) == 8:
@@ -90,57 +137,85 @@ def extract_files_flat_last_edit(html):
 
 @log_html_on_exception()
 def extract_files_index_data(html):
-    soup = BeautifulSoup(html, 'lxml')
+    forms = as_page(html).tree.xpath('//form[@id="files_table_form"]')
 
-    form = soup.find('form', id="files_table_form")
+    if not forms:
+        raise ParserError("index_data: files_table_form not found")
 
-    if "data-files" not in form.attrs:
+    form = forms[0]
+
+    if form.get("data-files") is None:
         raise ParserError("index_data: Missing data-files attribute in form")
 
-    if "data-folders" not in form.attrs:
+    if form.get("data-folders") is None:
         raise ParserError("index_data: Missing data-folders attribute in form")
 
-    form_data_files = json.loads(form["data-files"])
-    form_data_folders = json.loads(form["data-folders"])
+    form_data_files = json.loads(form.get("data-files"))
+    form_data_folders = json.loads(form.get("data-folders"))
 
     return form_data_files, form_data_folders
 
 
 @log_html_on_exception()
 def extract_parent_folder_id(html):
-    soup = BeautifulSoup(html, 'lxml')
-    folder_ids = soup.find_all(attrs={"name": "parent_folder_id"})
+    folder_ids = as_page(html).tree.xpath('//*[@name="parent_folder_id"]')
 
     if len(folder_ids) != 1:
         raise ParserError("Could not find parent folder ID")
 
-    return folder_ids.pop().attrs.get("value", "")
+    return folder_ids.pop().get("value", "")
 
 
 @log_html_on_exception()
 def extract_csrf_token(html):
-    soup = BeautifulSoup(html, 'lxml')
-    tokens = soup.find_all("input", attrs={"name": "security_token"})
+    tokens = as_page(html).tree.xpath('//input[@name="security_token"]')
 
     if len(tokens) < 1:
         raise ParserError("Could not find CSRF token")
 
-    return tokens.pop().attrs.get("value", "")
+    return tokens.pop().get("value", "")
+
+
+def is_login_page(html):
+    """Returns whether html contains the login form, which Stud.IP shows to anonymous users"""
+    # The names of the form fields don't depend on the language of the user interface
+    return bool(as_page(html).tree.xpath('//input[@name="login_ticket" or @name="loginname"]'))
 
 
 @log_html_on_exception()
 def extract_courses(html, only_recent_semester):
-    soup = BeautifulSoup(html, 'lxml')
-
-    p = re.compile("MyCoursesData = (.*);")
-    courses = None
-    for script in soup.find_all("script"):
-        try: 
-            courses = json.loads(script.string.split("MyCoursesData = ")[1].split(";")[0])
-        except Exception:
-            continue
+    def extract_json(page):
+        # Script contents aren't escaped in HTML, so the JSON can be decoded from the raw page
+        decoder = json.JSONDecoder()
+        courses = None
+
+        for match in re.finditer(r"MyCoursesData = ", page.html):
+            try:
+                courses = decoder.raw_decode(page.html, match.end())[0]
+            except ValueError:
+                continue
+
+        if not isinstance(courses, dict):
+            raise ParserError("courses: MyCoursesData not found")
 
-    if courses is None:
+        return courses
+
+    def extract_scripts(page):
+        courses = None
+        for script in page.soup.find_all("script"):
+            try:
+                courses = json.loads(script.string.split("MyCoursesData = ")[1].split(";")[0])
+            except Exception:
+                continue
+
+        if courses is None:
+            raise ParserError("courses: MyCoursesData not found in scripts")
+
+        return courses
+
+    try:
+        courses = try_parser_functions(html, [extract_json, extract_scripts])
+    except ParserError:
         raise ParserError("Could not find courses")
 
     for i, group in enumerate(courses["groups"]):
@@ -167,11 +242,9 @@ def extract_courses(html, only_recent_semester):
 
 @log_html_on_exception()
 def extract_media_list(html):
-    soup = BeautifulSoup(html, 'lxml')
-
     media_files = []
 
-    for table in soup.find_all("table", class_="media-table"):
+    for table in as_page(html).soup.find_all("table", class_="media-table"):
         if "id" not in table.attrs:
             raise ParserError("media_list: 'id' is missing from table")
 
@@ -202,8 +275,8 @@ def extract_media_list(html):
 
 @log_html_on_exception()
 def extract_media_best_download_link(html):
-    def extract_table(_, s):
-        download_options = s.select("table#dllist tr td")
+    def extract_table(page):
+        download_options = page.soup.select("table#dllist tr td")
 
         if not download_options or len(download_options) <= 1:
             raise ParserError("media_download_link: No download options found")
@@ -219,8 +292,8 @@ def extract_media_best_download_link(html):
 
         return download_a["href"]
 
-    def extract_iframe(_, s):
-        iframe = s.find("iframe", id="framed_player")
+    def extract_iframe(page):
+        iframe = page.soup.find("iframe", id="framed_player")
         if not iframe:
             raise ParserError("media_download_link: No iframe found")
 
@@ -229,8 +302,8 @@ def extract_media_best_download_link(html):
 
         return iframe.attrs["src"]
 
-    def extract_video(_, s):
-        video = s.find("video", id="mediaplayer_html5_api")
+    def extract_video(page):
+        video = page.soup.find("video", id="mediaplayer_html5_api")
         if not video:
             raise ParserError("media_download_link: No video item found")
 
@@ -239,10 +312,10 @@ def extract_media_best_download_link(html):
 
         return video.attrs["src"]
 
-    def extract_video_regex(h, _):
+    def extract_video_regex(page):
 
         matcher = re.compile(r"/plugins.php/mediacastplugin/media/check/.+\.mp4")
-        links = matcher.findall(h)
+        links = matcher.findall(page.html)
 
         if len(links) < 1:
             raise ParserError("media_download_link: links < 1")
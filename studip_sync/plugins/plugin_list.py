@@ -1,3 +1,8 @@
+import queue
+import threading
+
+from studip_sync.constants import PLUGIN_QUEUE_SIZE
+from studip_sync.metrics import METRICS
 from studip_sync.plugins.plugin_loader import PluginLoader
 
 
@@ -14,6 +19,63 @@ class PluginList(list):
 
             self.append(plugin)
 
+        self.queues = {}
+        self.workers = []
+        self.lock = threading.Lock()
+
     def hook(self, hook_name, *args, **kwargs):
         for plugin in self:
             getattr(plugin, hook_name)(*args, **kwargs)
+
+    def hook_async(self, hook_name, *args, **kwargs):
+        """Calls the hook of every plugin from a background thread of that plugin
+
+        Every plugin has its own worker and queue, so a slow plugin neither holds up the downloads
+        nor the other plugins, and its hooks are still called one after another in order. Only
+        once PLUGIN_QUEUE_SIZE hooks of a plugin are waiting, hook_async() blocks until there is
+        room again. Errors of the hooks are printed instead of being raised, flush() waits until
+        all hooks were called.
+        """
+        for plugin in self:
+            self._queue(plugin).put((hook_name, args, kwargs))
+
+    def _queue(self, plugin):
+        with self.lock:
+            plugin_queue = self.queues.get(plugin)
+
+            if plugin_queue is None:
+                plugin_queue = self.queues[plugin] = queue.Queue(PLUGIN_QUEUE_SIZE)
+                worker = threading.Thread(target=self._work, args=(plugin, plugin_queue),
+                                          daemon=True)
+                worker.start()
+                self.workers.append((plugin_queue, worker))
+
+            return plugin_queue
+
+    @staticmethod
+    def _work(plugin, plugin_queue):
+        while True:
+            item = plugin_queue.get()
+            if item is None:
+                return
+
+            hook_name, args, kwargs = item
+            try:
+                getattr(plugin, hook_name)(*args, **kwargs)
+            except Exception as e:
+                METRICS.inc("studip_sync_plugin_hook_errors", plugin=plugin.plugin_name,
+                            hook=hook_name)
+                plugin.print("{} failed: {}".format(hook_name, e))
+
+    def flush(self):
+        """Waits until every hook passed to hook_async() was called and stops the workers"""
+        with self.lock:
+            workers = self.workers
+            self.workers = []
+            self.queues = {}
+
+        for plugin_queue, _ in workers:
+            plugin_queue.put(None)
+
+        for _, worker in workers:
+            worker.join()
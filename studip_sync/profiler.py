@@ -0,0 +1,280 @@
+import functools
+import importlib
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from studip_sync.metrics import METRICS, endpoint_type
+
+# module, attribute path, category
+TARGETS = [
+    ("requests", "Session.request", "http"),
+    ("studip_sync.session", "Session.login", "session"),
+    ("studip_sync.session", "Session.restore_login", "session"),
+    ("studip_sync.session", "Session.get_parsed", "session"),
+    ("studip_sync.session", "Session.parse_response", "session"),
+    ("studip_sync.session", "Session.get_courses", "session"),
+    ("studip_sync.session", "Session.check_course_new_files", "session"),
+    ("studip_sync.session", "Session.get_files_index", "session"),
+    ("studip_sync.session", "Session.get_files_index_from_api", "session"),
+    ("studip_sync.session", "Session.download_file", "session"),
+    ("studip_sync.session", "Session.download_file_api", "session"),
+    ("studip_sync.session", "Session.download_media", "session"),
+    ("studip_sync.session", "Session.find_missing_media", "session"),
+    ("studip_sync.session", "Session.resolve_media_url", "session"),
+    ("studip_sync.session", "Session.download_media_file", "session"),
+    ("studip_sync.session", "PartialDownload.write", "transfer"),
+    ("studip_sync.session", "PartialDownload.commit", "disk"),
+    ("studip_sync.async_session", "AsyncSession.get", "http"),
+    ("studip_sync.parsers", "Page.soup", "parse"),
+    ("studip_sync.parsers", "Page.tree", "parse"),
+    ("studip_sync.parsers", "extract_files_flat_last_edit", "parse"),
+    ("studip_sync.parsers", "extract_files_index_data", "parse"),
+    ("studip_sync.parsers", "extract_parent_folder_id", "parse"),
+    ("studip_sync.parsers", "extract_csrf_token", "parse"),
+    ("studip_sync.parsers", "extract_courses", "parse"),
+    ("studip_sync.parsers", "extract_media_list", "parse"),
+    ("studip_sync.parsers", "extract_media_best_download_link", "parse"),
+    ("studip_sync.studip_rsync", "CourseTreeCrawler.crawl", "files"),
+    ("studip_sync.studip_rsync", "CourseRSync.download_recursive", "files"),
+    ("studip_sync.studip_rsync", "CourseRSync.download_file", "files"),
+    ("studip_sync.studip_rsync", "CourseRSync.keep_old_version", "disk"),
+    ("studip_sync.studip_rsync", "list_folder", "disk"),
+    ("studip_sync.object_store", "ObjectStore.add", "disk"),
+    ("studip_sync.object_store", "ObjectStore.link", "disk"),
+    ("studip_sync.studip_sync", "Extractor.extract_stream", "files"),
+    ("studip_sync.tree_sync", "TreeSync.sync", "disk"),
+]
+
+SUMMARY_ROWS = 20
+
+
+def _describe_request(args, kwargs):
+    # requests.Session.request(self, method, url, ...)
+    method = kwargs.get("method", args[1] if len(args) > 1 else "")
+    url = kwargs.get("url", args[2] if len(args) > 2 else "")
+
+    endpoint = getattr(METRICS.local, "endpoint", None) or endpoint_type(url)
+
+    return "{} {}".format(method, endpoint), {"url": url}
+
+
+def _describe_async_request(args, kwargs):
+    # AsyncSession.get(self, url, params=None, headers=None)
+    url = kwargs.get("url", args[1] if len(args) > 1 else "")
+
+    return "GET {}".format(endpoint_type(url)), {"url": url}
+
+
+# Functions whose spans are named after their arguments instead of the function
+DESCRIBE = {
+    ("requests", "Session.request"): _describe_request,
+    ("studip_sync.async_session", "AsyncSession.get"): _describe_async_request,
+}
+
+
+class Profiler(object):
+    """Records how long the instrumented functions take, per thread
+
+    Nothing is instrumented until enable() is called, so a sync without --profile runs the
+    original functions. The spans can be written as a Chrome trace (chrome://tracing or
+    https://ui.perfetto.dev) and summed up by their own time, which excludes nested spans.
+    """
+
+    def __init__(self):
+        super(Profiler, self).__init__()
+        self.events = []
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started = None
+        self.patches = []
+
+    def _stack(self):
+        stack = getattr(self.local, "stack", None)
+        if stack is None:
+            stack = self.local.stack = []
+        return stack
+
+    def _record(self, name, category, start, duration, self_duration, args=None,
+                asynchronous=False):
+        event = (name, category, start, duration, self_duration, threading.get_ident(),
+                 threading.current_thread().name, args, asynchronous)
+
+        with self.lock:
+            self.events.append(event)
+
+    def wrap(self, func, name, category, describe=None):
+        if inspect.iscoroutinefunction(func):
+            return self._wrap_coroutine_function(func, name, category, describe)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            span_name, span_args = describe(args, kwargs) if describe else (name, None)
+
+            stack = self._stack()
+            stack.append(0.0)
+            start = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except BaseException:
+                self._end_span(stack, span_name, category, start, span_args)
+                raise
+
+            if inspect.isgenerator(result):
+                # The work of a generator happens while it is consumed, not when it is created
+                stack.pop()
+                return self._wrap_generator(result, span_name, category)
+
+            self._end_span(stack, span_name, category, start, span_args)
+            return result
+
+        return wrapper
+
+    def _end_span(self, stack, name, category, start, args):
+        duration = time.perf_counter() - start
+        children = stack.pop()
+        if stack:
+            stack[-1] += duration
+
+        self._record(name, category, start, duration, duration - children, args)
+
+    def _wrap_coroutine_function(self, func, name, category, describe=None):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            span_name, span_args = describe(args, kwargs) if describe else (name, None)
+
+            # Coroutines interleave on the thread of the event loop, so their spans aren't nested
+            # on the stack of the thread and the time they wait counts as their own time
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                duration = time.perf_counter() - start
+                self._record(span_name, category, start, duration, duration, span_args,
+                             asynchronous=True)
+
+        return wrapper
+
+    def _wrap_generator(self, generator, name, category):
+        start = time.perf_counter()
+        try:
+            yield from generator
+        finally:
+            duration = time.perf_counter() - start
+            self._record(name, category, start, duration, duration)
+
+    def instrument(self, module_name, attribute_path, category):
+        owner = importlib.import_module(module_name)
+        *owner_path, attribute = attribute_path.split(".")
+        for part in owner_path:
+            owner = getattr(owner, part)
+
+        original = inspect.getattr_static(owner, attribute)
+        describe = DESCRIBE.get((module_name, attribute_path))
+        name = attribute_path if describe is None else None
+
+        if isinstance(original, property):
+            patched = property(self.wrap(original.fget, name, category, describe),
+                               original.fset, original.fdel, original.__doc__)
+        elif isinstance(original, staticmethod):
+            patched = staticmethod(self.wrap(original.__func__, name, category, describe))
+        else:
+            patched = self.wrap(original, name, category, describe)
+
+        setattr(owner, attribute, patched)
+        self.patches.append((owner, attribute, original))
+
+    def enable(self, targets=None):
+        self.started = time.perf_counter()
+
+        for module_name, attribute_path, category in targets or TARGETS:
+            self.instrument(module_name, attribute_path, category)
+
+    def disable(self):
+        while self.patches:
+            owner, attribute, original = self.patches.pop()
+            setattr(owner, attribute, original)
+
+    def write_trace(self, path):
+        with self.lock:
+            events = list(self.events)
+
+        thread_ids = {}
+        trace_events = []
+        for i, (name, category, start, duration, _, thread, thread_name, args,
+                asynchronous) in enumerate(events):
+            if thread not in thread_ids:
+                thread_ids[thread] = len(thread_ids) + 1
+                trace_events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(),
+                                     "tid": thread_ids[thread], "args": {"name": thread_name}})
+
+            event = {"name": name, "cat": category, "pid": os.getpid(),
+                     "tid": thread_ids[thread], "ts": round((start - self.started) * 1e6, 1)}
+            if args:
+                event["args"] = args
+
+            if asynchronous:
+                # Overlapping spans of coroutines are shown as async events on their own tracks
+                end = {"name": name, "cat": category, "ph": "e", "id": i, "pid": os.getpid(),
+                       "tid": thread_ids[thread],
+                       "ts": round((start + duration - self.started) * 1e6, 1)}
+                event.update(ph="b", id=i)
+                trace_events.extend((event, end))
+            else:
+                event.update(ph="X", dur=round(duration * 1e6, 1))
+                trace_events.append(event)
+
+        with open(path, "w") as file:
+            json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
+
+    def summary(self, rows=SUMMARY_ROWS):
+        with self.lock:
+            events = list(self.events)
+
+        totals = {}
+        for name, category, _, duration, self_duration, _, _, _, _ in events:
+            total = totals.setdefault(name, {"category": category, "calls": 0, "total": 0.0,
+                                             "self": 0.0, "max": 0.0})
+            total["calls"] += 1
+            total["total"] += duration
+            total["self"] += self_duration
+            total["max"] = max(total["max"], duration)
+
+        wall_time = time.perf_counter() - self.started
+
+        lines = ["Top time sinks of {:.2f}s (own time without nested spans, summed over "
+                 "threads):".format(wall_time),
+                 "{:<48} {:<9} {:>6} {:>9} {:>9} {:>9}".format(
+                     "span", "category", "calls", "self", "total", "max")]
+
+        for name, total in sorted(totals.items(), key=lambda item: -item[1]["self"])[:rows]:
+            lines.append("{:<48} {:<9} {:>6} {:>8.3f}s {:>8.3f}s {:>8.3f}s".format(
+                name[:48], total["category"], total["calls"], total["self"], total["total"],
+                total["max"]))
+
+        return "\n".join(lines)
+
+    @contextmanager
+    def profile(self, path):
+        """Instruments everything inside the block and writes the trace to path
+
+        Without a path, the block runs without any instrumentation.
+        """
+        if not path:
+            yield
+            return
+
+        self.enable()
+        try:
+            yield
+        finally:
+            self.disable()
+            self.write_trace(path)
+            print(self.summary())
+            print("Trace written to {}".format(path))
+
+
+PROFILER = Profiler()
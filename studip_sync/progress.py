@@ -0,0 +1,246 @@
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+from studip_sync.bandwidth import format_size
+
+PROGRESS_AUTO = "auto"
+PROGRESS_TTY = "tty"
+PROGRESS_SUMMARY = "summary"
+PROGRESS_NONE = "none"
+PROGRESS_MODES = (PROGRESS_AUTO, PROGRESS_TTY, PROGRESS_SUMMARY, PROGRESS_NONE)
+
+# Seconds between two redraws of the status line and between two summaries
+TTY_INTERVAL = 0.25
+SUMMARY_INTERVAL = 60
+# Time constant of the moving average of the throughput in seconds
+RATE_WINDOW = 10
+
+CLEAR_LINE = "\r\033[K"
+
+
+def format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+
+    return "{}:{:02}:{:02}".format(hours, minutes, seconds)
+
+
+class Progress(object):
+    """Progress of all downloads of a sync
+
+    The discovery of files and media adds the work to do, the downloads report the bytes they
+    read and the files they finished. On a terminal a status line with the total and the
+    per-transfer throughput and the ETA is kept below the regular output, otherwise a summary is
+    printed every SUMMARY_INTERVAL seconds. Updates are cheap no-ops until show() starts it.
+    """
+
+    def __init__(self):
+        super(Progress, self).__init__()
+        self.enabled = False
+        self.lock = threading.RLock()
+        self.files_total = 0
+        self.files_done = 0
+        self.files_unknown_size = 0
+        self.bytes_total = 0
+        self.bytes_done = 0
+        self.transfers = []
+        self.rate = 0.0
+        self.rate_sample = (time.monotonic(), 0)
+        self.stream = None
+        self.status = ""
+
+    def add_files(self, count, size=None):
+        """Adds count files to download, whose sizes add up to size or are unknown if it's None"""
+        if not self.enabled or not count:
+            return
+
+        with self.lock:
+            self.files_total += count
+            if size is None:
+                self.files_unknown_size += count
+            else:
+                self.bytes_total += size
+
+    def learn_size(self, size):
+        """Adds the size of a file that was added without one, once the server sent it"""
+        if not self.enabled:
+            return
+
+        with self.lock:
+            if self.files_unknown_size:
+                self.files_unknown_size -= 1
+                self.bytes_total += size
+
+    def advance(self, amount):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.bytes_done += amount
+
+    def file_done(self, size=None, transferred=0):
+        """Marks a file as finished, the part of size that wasn't transferred counts as done"""
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.files_done += 1
+            if size is not None and size > transferred:
+                self.bytes_done += size - transferred
+
+    def transfer_started(self, transfer):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.transfers.append(transfer)
+
+    def transfer_finished(self, transfer):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            if transfer in self.transfers:
+                self.transfers.remove(transfer)
+
+    def _update_rate(self):
+        now = time.monotonic()
+        last_time, last_bytes = self.rate_sample
+        elapsed = now - last_time
+        if elapsed <= 0:
+            return
+
+        # Exponential moving average, so the ETA doesn't jump with every chunk
+        weight = min(1.0, elapsed / RATE_WINDOW)
+        current_rate = (self.bytes_done - last_bytes) / elapsed
+        self.rate = current_rate if not self.rate else \
+            self.rate + weight * (current_rate - self.rate)
+        self.rate_sample = (now, self.bytes_done)
+
+    def summary(self):
+        with self.lock:
+            self._update_rate()
+
+            parts = ["{}/{} files".format(self.files_done, self.files_total)]
+
+            if self.bytes_total:
+                parts.append("{} of {} ({:.0f}%)".format(
+                    format_size(self.bytes_done), format_size(self.bytes_total),
+                    min(100, 100 * self.bytes_done / self.bytes_total)))
+            else:
+                parts.append(format_size(self.bytes_done))
+
+            parts.append("{}/s".format(format_size(self.rate)))
+
+            remaining = self.bytes_total - self.bytes_done
+            if self.rate > 0 and remaining > 0:
+                eta = "ETA " + format_duration(remaining / self.rate)
+                if self.files_unknown_size:
+                    eta += " +{} of unknown size".format(self.files_unknown_size)
+                parts.append(eta)
+
+            return ", ".join(parts)
+
+    def transfer_summary(self):
+        with self.lock:
+            transfers = list(self.transfers)
+
+        if not transfers:
+            return ""
+
+        # The slowest transfer is the one worth watching
+        transfer = min(transfers, key=lambda t: t.throughput)
+        text = "{} {}/s".format(transfer.name or "download", format_size(transfer.throughput))
+        if transfer.expected_size:
+            text += " {:.0f}%".format(min(100, 100 * transfer.size / transfer.expected_size))
+        if len(transfers) > 1:
+            text += " (+{} more)".format(len(transfers) - 1)
+
+        return text
+
+    def _status_line(self):
+        line = self.summary()
+        transfers = self.transfer_summary()
+        if transfers:
+            line += " | " + transfers
+
+        width = shutil.get_terminal_size().columns - 1
+        return line[:width]
+
+    def write(self, text):
+        """Writes regular output above the status line"""
+        with self.lock:
+            if self.status:
+                self.stream.write(CLEAR_LINE)
+                self.status = ""
+
+            result = self.stream.write(text)
+
+            if text.endswith("\n"):
+                self._draw()
+
+        return result
+
+    def flush(self):
+        self.stream.flush()
+
+    def isatty(self):
+        return self.stream.isatty()
+
+    def _draw(self):
+        self.status = self._status_line()
+        self.stream.write(CLEAR_LINE + self.status)
+        self.stream.flush()
+
+    def _run_tty(self, stop):
+        while not stop.wait(TTY_INTERVAL):
+            with self.lock:
+                if self.status != self._status_line():
+                    self._draw()
+
+    def _run_summary(self, stop):
+        while not stop.wait(SUMMARY_INTERVAL):
+            with self.lock:
+                if self.files_done < self.files_total:
+                    print("Progress: " + self.summary())
+
+    @contextmanager
+    def show(self, mode=PROGRESS_AUTO):
+        if mode == PROGRESS_AUTO:
+            mode = PROGRESS_TTY if sys.stdout.isatty() else PROGRESS_SUMMARY
+
+        if mode == PROGRESS_NONE:
+            yield
+            return
+
+        self.enabled = True
+        stop = threading.Event()
+
+        if mode == PROGRESS_TTY:
+            # Regular output goes through write(), so it doesn't garble the status line
+            self.stream = sys.stdout
+            sys.stdout = self
+            thread = threading.Thread(target=self._run_tty, args=(stop,), daemon=True)
+        else:
+            thread = threading.Thread(target=self._run_summary, args=(stop,), daemon=True)
+
+        thread.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            thread.join()
+            self.enabled = False
+
+            if mode == PROGRESS_TTY:
+                with self.lock:
+                    if self.status:
+                        self.stream.write(CLEAR_LINE)
+                        self.status = ""
+                    sys.stdout = self.stream
+
+
+PROGRESS = Progress()
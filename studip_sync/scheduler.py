@@ -0,0 +1,114 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Future
+
+SCHEDULE_ORDER = "order"
+SCHEDULE_SMALL_FIRST = "small-first"
+SCHEDULE_NEWEST_FIRST = "newest-first"
+SCHEDULE_FAIR = "fair"
+SCHEDULE_POLICIES = (SCHEDULE_ORDER, SCHEDULE_SMALL_FIRST, SCHEDULE_NEWEST_FIRST, SCHEDULE_FAIR)
+
+
+def parse_policies(value):
+    """Parses a comma separated list of policies like "fair,small-first" """
+    policies = [policy.strip() for policy in value.split(",") if policy.strip()]
+
+    for policy in policies:
+        if policy not in SCHEDULE_POLICIES:
+            raise ValueError("Unknown schedule policy: {} (Choose from {})".format(
+                policy, ", ".join(SCHEDULE_POLICIES)))
+
+    return policies or [SCHEDULE_ORDER]
+
+
+class DownloadScheduler(object):
+    """Thread pool which runs the downloads of all courses in the order of its policies
+
+    Every download is submitted with the course it belongs to and, if known, its size and its
+    change date. The policies are applied one after another, ties are broken by the order of
+    submission:
+
+    - order: in the order the downloads were found
+    - small-first: smaller files first, downloads of unknown size last
+    - newest-first: recently changed files first, downloads without a date last
+    - fair: round robin between the courses
+    """
+
+    def __init__(self, workers, policies=None):
+        super(DownloadScheduler, self).__init__()
+        self.policies = policies or [SCHEDULE_ORDER]
+        self.queue = []
+        self.counter = itertools.count()
+        self.course_counts = {}
+        self.condition = threading.Condition()
+        self.closed = False
+        self.threads = [threading.Thread(target=self._work, daemon=True)
+                        for _ in range(max(1, workers))]
+
+        for thread in self.threads:
+            thread.start()
+
+    def _priority(self, policy, course_index, size, chdate):
+        if policy == SCHEDULE_SMALL_FIRST:
+            return size if size is not None else float("inf")
+        elif policy == SCHEDULE_NEWEST_FIRST:
+            return -chdate if chdate is not None else float("inf")
+        elif policy == SCHEDULE_FAIR:
+            return course_index
+
+        return 0
+
+    def submit(self, course_id, size, chdate, func, *args, **kwargs):
+        future = Future()
+
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Cannot schedule downloads after shutdown")
+
+            course_index = self.course_counts.get(course_id, 0)
+            self.course_counts[course_id] = course_index + 1
+
+            priority = tuple(self._priority(policy, course_index, size, chdate)
+                             for policy in self.policies) + (next(self.counter),)
+
+            heapq.heappush(self.queue, (priority, future, func, args, kwargs))
+            self.condition.notify()
+
+        return future
+
+    def _work(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+
+                if not self.queue:
+                    return
+
+                _, future, func, args, kwargs = heapq.heappop(self.queue)
+
+            if not future.set_running_or_notify_cancel():
+                continue
+
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def shutdown(self, wait=True, cancel_futures=False):
+        with self.condition:
+            self.closed = True
+
+            if cancel_futures:
+                for _, future, _, _, _ in self.queue:
+                    future.cancel()
+                self.queue = []
+
+            self.condition.notify_all()
+
+        if wait:
+            for thread in self.threads:
+                thread.join()
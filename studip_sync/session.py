@@ -1,17 +1,30 @@
+import hashlib
 import os
-import shutil
 import time
 import urllib.parse
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
 import requests
+from requests.adapters import HTTPAdapter
 
 from studip_sync import parsers
+from studip_sync.bandwidth import BANDWIDTH_FILES, BANDWIDTH_MEDIA, TransferStream
 from studip_sync.constants import URL_BASEURL_DEFAULT, AUTHENTICATION_TYPES
+from studip_sync.http_cache import HTTPCache
+from studip_sync.media_index import MEDIA_STATE_COMPLETE, MEDIA_STATE_PARTIAL, scan_media_dir
+from studip_sync.metrics import METRICS
 from studip_sync.parsers import ParserError
+from studip_sync.progress import PROGRESS
 from studip_sync.plugins.plugin_list import PluginList
 
 
+COPY_BUFSIZE = 1024 * 1024
+PARTIAL_FILE_PREFIX = ".studip-sync-part-"
+
+
 class SessionError(Exception):
     pass
 
@@ -32,6 +45,150 @@ class DownloadError(SessionError):
     pass
 
 
+class PartialDownload(object):
+    """File which is being downloaded, together with a sidecar file holding the response validators
+
+    As long as the sidecar exists, an interrupted download can be resumed with a Range request.
+    If-Range makes sure the server only sends the missing part if the file didn't change in the
+    meantime, otherwise the download starts over.
+    """
+
+    def __init__(self, path, name=None):
+        super(PartialDownload, self).__init__()
+        self.path = path
+        self.name = name
+        self.sidecar_path = path + ".json"
+        self.info = self._load_info()
+        self.transfer = None
+
+    def _load_info(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        try:
+            with open(self.sidecar_path) as sidecar:
+                return json.load(sidecar)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_info(self):
+        with open(self.sidecar_path, "w") as sidecar:
+            json.dump(self.info, sidecar)
+
+    @property
+    def headers(self):
+        return self.info.get("headers", {})
+
+    def resume_headers(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        offset = os.path.getsize(self.path)
+        size = self.info.get("size")
+        headers = self.headers
+        validator = headers.get("ETag") or headers.get("Last-Modified")
+
+        # Weak ETags are not allowed in If-Range
+        if not offset or size is None or offset >= size or not validator or \
+                validator.startswith("W/"):
+            return {}
+
+        return {"Range": "bytes={}-".format(offset), "If-Range": validator}
+
+    def can_write(self, response):
+        """Returns whether response is the whole file or continues the partial file where it ends"""
+        if response.status_code != 206:
+            return True
+
+        offset = self._parse_content_range(response.headers.get("Content-Range", ""))
+        return offset is not None and os.path.exists(self.path) and \
+            offset == os.path.getsize(self.path)
+
+    def write(self, response, expected_size=None, bandwidth=None, kind=BANDWIDTH_FILES):
+        """Writes the body of a streamed response to the partial file
+
+        Returns the SHA-256 hash and the size of the whole file. If expected_size is given, the
+        download stops as soon as the file turns out to be larger. The body is read through the
+        bandwidth limiter, if there is one, and the throughput is kept in self.transfer.
+        """
+        content_hash = hashlib.sha256()
+        stream = TransferStream(response.raw, bandwidth, kind, PROGRESS)
+        self.transfer = stream.transfer
+        self.transfer.name = self.name
+
+        content_length = response.headers.get("Content-Length")
+        if content_length:
+            self.transfer.expected_size = int(content_length)
+
+        if response.status_code == 206:
+            if not self.can_write(response):
+                self.discard()
+                raise DownloadError("Server resumed the download at an unexpected position")
+
+            offset = os.path.getsize(self.path)
+
+            with open(self.path, "rb") as file:
+                for chunk in iter(lambda: file.read(COPY_BUFSIZE), b""):
+                    content_hash.update(chunk)
+
+            mode = "ab"
+            size = offset
+        else:
+            self.info = {
+                "size": self.transfer.expected_size,
+                "headers": {key: response.headers[key] for key in
+                            ("ETag", "Last-Modified", "Content-Disposition")
+                            if key in response.headers}
+            }
+            self._save_info()
+
+            mode = "wb"
+            size = 0
+
+        PROGRESS.transfer_started(self.transfer)
+        try:
+            with open(self.path, mode) as file:
+                while True:
+                    chunk = stream.read(COPY_BUFSIZE)
+                    if not chunk:
+                        break
+
+                    content_hash.update(chunk)
+                    file.write(chunk)
+                    size += len(chunk)
+
+                    if expected_size is not None and size > expected_size:
+                        break
+        finally:
+            self.transfer.finish()
+            PROGRESS.transfer_finished(self.transfer)
+
+        return content_hash.hexdigest(), size
+
+    @staticmethod
+    def _parse_content_range(content_range):
+        # Format: "bytes start-end/size"
+        try:
+            return int(content_range.split(" ", 1)[1].split("-", 1)[0])
+        except (IndexError, ValueError):
+            return None
+
+    def commit(self, path):
+        """Moves the completely downloaded file to path"""
+        os.replace(self.path, path)
+        self._remove_sidecar()
+
+    def discard(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+        self._remove_sidecar()
+
+    def _remove_sidecar(self):
+        if os.path.exists(self.sidecar_path):
+            os.remove(self.sidecar_path)
+
+
 class URL(object):
     def __init__(self, base_url):
         self.base_url = base_url
@@ -75,11 +232,21 @@ class URL(object):
 
 class Session(object):
 
-    def __init__(self, plugins=None, base_url=URL_BASEURL_DEFAULT):
+    def __init__(self, plugins=None, base_url=URL_BASEURL_DEFAULT, pool_size=None, cache=None,
+                 bandwidth=None):
         super(Session, self).__init__()
         self.session = requests.Session()
         self.session.headers.update({"User-Agent": "WeWantFileSync"})
+        self.session.hooks["response"].append(METRICS.count_response)
+
+        if pool_size:
+            # Keep enough connections alive for all threads sharing this session
+            adapter = HTTPAdapter(pool_maxsize=pool_size)
+            self.session.mount("https://", adapter)
+            self.session.mount("http://", adapter)
         self.url = URL(base_url)
+        self.cache = cache
+        self.bandwidth = bandwidth
 
         if plugins is None:
             self.plugins = PluginList()
@@ -99,23 +266,125 @@ class Session(object):
         auth = AUTHENTICATION_TYPES[auth_type]
         auth.login(self, username, password, auth_type_data)
 
+    def is_logged_in(self):
+        with self.session.get(self.url.studip_main()) as response:
+            # Without a valid session Stud.IP redirects to or shows the login page
+            return response.ok and response.url.startswith(self.url.studip_main()) and \
+                   not parsers.is_login_page(response.text)
+
+    def restore_login(self, cookie_file, username):
+        """Loads the cookies of an earlier login and checks if they are still valid"""
+        try:
+            with open(cookie_file) as file:
+                saved_login = json.load(file)
+        except (OSError, ValueError):
+            return False
+
+        if not isinstance(saved_login, dict) or \
+                saved_login.get("base_url") != self.url.base_url or \
+                saved_login.get("username") != username:
+            return False
+
+        try:
+            for cookie in saved_login["cookies"]:
+                self.session.cookies.set(cookie["name"], cookie["value"],
+                                         domain=cookie["domain"], path=cookie["path"])
+        except (KeyError, TypeError):
+            self.session.cookies.clear()
+            return False
+
+        if self.is_logged_in():
+            return True
+
+        self.session.cookies.clear()
+        return False
+
+    def save_login(self, cookie_file, username):
+        saved_login = {
+            "base_url": self.url.base_url,
+            "username": username,
+            "cookies": [{"name": cookie.name, "value": cookie.value, "domain": cookie.domain,
+                         "path": cookie.path} for cookie in self.session.cookies]
+        }
+
+        # The cookies grant access to the account, so only the user may read them. An existing
+        # temporary file would keep its mode, so it is replaced.
+        temp_file = cookie_file + ".tmp"
+        try:
+            os.unlink(temp_file)
+        except FileNotFoundError:
+            pass
+
+        fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "w") as file:
+            json.dump(saved_login, file)
+        os.replace(temp_file, cookie_file)
+
+    def get_parsed(self, url, parse, check_response, params=None, variant=""):
+        """GETs url and returns the result of parse(html)
+
+        If a cache is set, the validators of the last response are sent along and the cached
+        result is reused if the page didn't change. variant distinguishes different parse
+        functions for the same url.
+        """
+        key, entry = self.cache_entry(url, params, variant)
+
+        with self.session.get(url, params=params,
+                              headers=HTTPCache.request_headers(entry)) as response:
+            return self.parse_response(response, key, entry, parse, check_response)
+
+    def cache_entry(self, url, params=None, variant=""):
+        """Returns the cache key and the cached entry of a page, both are None without a cache"""
+        if self.cache is None:
+            return None, None
+
+        key = self.cache.key(url, params, variant)
+        return key, self.cache.get(key)
+
+    def parse_response(self, response, key, entry, parse, check_response):
+        """Returns the result of parse for a response to a request with the validators of entry"""
+        if entry is not None and response.status_code == 304:
+            self.cache.touch(key)
+            return entry["result"]
+
+        check_response(response)
+
+        if self.cache is None:
+            return parse(response.text)
+
+        # Without validators, at least skip parsing if the page is exactly the same
+        content_hash = self.cache.content_hash(response.content)
+        if entry is not None and entry["content_hash"] == content_hash:
+            self.cache.touch(key, response)
+            return entry["result"]
+
+        result = parse(response.text)
+        self.cache.put(key, response, content_hash, result)
+        return result
+
     def get_courses(self, only_recent_semester=False):
-        with self.session.get(self.url.courses()) as response:
+        def _check_response(response):
             if not response.ok:
                 raise SessionError("Failed to get courses")
 
-            return parsers.extract_courses(response.text, only_recent_semester)
+        def _parse(html):
+            return list(parsers.extract_courses(html, only_recent_semester))
+
+        return self.get_parsed(self.url.courses(), _parse, _check_response,
+                               variant="recent" if only_recent_semester else "all")
 
     def check_course_new_files(self, course_id, last_sync):
         params = {"cid": course_id}
 
-        with self.session.get(self.url.files_flat(), params=params) as response:
+        def _check_response(response):
             if not response.ok:
                 if response.status_code == 403 and "Documents" in response.text:
                     raise MissingFeatureError("This course has no files")
                 else:
                     raise DownloadError("Cannot access course files_flat page")
-            last_edit = parsers.extract_files_flat_last_edit(response.text)
+
+        last_edit = self.get_parsed(self.url.files_flat(), parsers.extract_files_flat_last_edit,
+                                    _check_response, params=params)
 
         if last_edit == 0:
             print("\tLast file edit couldn't be detected!")
@@ -124,14 +393,20 @@ class Session(object):
                 time.strftime("%d.%m.%Y %H:%M", time.gmtime(last_edit))))
         return last_edit == 0 or last_edit > last_sync
 
-    def download(self, course_id, workdir, sync_only=None):
+    @contextmanager
+    def stream_download(self, course_id, sync_only=None):
+        """Requests the bulk download of a course and yields the stream of the zip archive
+
+        The throughput of the download is available as stream.transfer.
+        """
         params = {"cid": course_id}
 
         with self.session.get(self.url.files_main(), params=params) as response:
             if not response.ok:
                 raise DownloadError("Cannot access course files page")
-            folder_id = parsers.extract_parent_folder_id(response.text)
-            csrf_token = parsers.extract_csrf_token(response.text)
+            page = parsers.Page(response.text)
+            folder_id = parsers.extract_parent_folder_id(page)
+            csrf_token = parsers.extract_csrf_token(page)
 
         download_url = self.url.bulk_download(folder_id)
         data = {
@@ -144,32 +419,71 @@ class Session(object):
         with self.session.post(download_url, params=params, data=data, stream=True) as response:
             if not response.ok:
                 raise DownloadError("Cannot download course files")
-            path = os.path.join(workdir, course_id)
-            with open(path, "wb") as download_file:
-                shutil.copyfileobj(response.raw, download_file)
-                return path
 
-    def download_file(self, download_url, tempfile):
-        with self.session.post(download_url, stream=True) as response:
+            response.raw.decode_content = True
+            stream = TransferStream(response.raw, self.bandwidth, BANDWIDTH_FILES, PROGRESS)
+            stream.transfer.name = "course archive"
+
+            # The size of the archive is only known once the server sends it
+            PROGRESS.add_files(1)
+            if response.headers.get("Content-Length"):
+                PROGRESS.learn_size(int(response.headers["Content-Length"]))
+
+            PROGRESS.transfer_started(stream.transfer)
+            try:
+                yield stream
+            finally:
+                PROGRESS.transfer_finished(stream.transfer)
+                PROGRESS.file_done()
+
+    @staticmethod
+    @contextmanager
+    def resumed_request(send, partial):
+        """Yields the response of send(headers), which resumes the download of partial if possible
+
+        If the server refuses the ranged request or continues at the wrong position, the partial
+        file is discarded and the whole file is requested once more, so a partial file that can't
+        be resumed doesn't fail every later run.
+        """
+        headers = partial.resume_headers()
+
+        with send(headers) as response:
+            if not headers or (response.ok and partial.can_write(response)):
+                yield response
+                return
+
+        partial.discard()
+
+        with send({}) as response:
+            yield response
+
+    def download_file(self, download_url, partial, expected_size=None):
+        def _send(headers):
+            return self.session.post(download_url, stream=True, headers=headers)
+
+        with self.resumed_request(_send, partial) as response:
             if not response.ok:
                 raise DownloadError("Cannot download file")
 
-            with open(tempfile, "wb") as file:
-                shutil.copyfileobj(response.raw, file)
-
+            return partial.write(response, expected_size, self.bandwidth)
 
-    def download_file_api(self, file_id, tempfile):
+    def download_file_api(self, file_id, partial, expected_size=None):
         download_url = self.url.files_api_download(file_id)
-        
-        with self.session.get(download_url, stream=True) as response:
+
+        def _send(headers):
+            return self.session.get(download_url, stream=True, headers=headers)
+
+        with self.resumed_request(_send, partial) as response:
             if not response.ok:
-                print(response.text)
-                raise DownloadError("Cannot download file")
+                raise DownloadError("Cannot download file: " + response.text)
 
-            with open(tempfile, "wb") as file:
-                shutil.copyfileobj(response.raw, file)
+            return partial.write(response, expected_size, self.bandwidth)
 
     def get_files_index(self, course_id, folder_id=None):
+        return self.get_parsed(**self.files_index_request(course_id, folder_id))
+
+    def files_index_request(self, course_id, folder_id=None):
+        """Returns the arguments of get_parsed() for the files page of a folder"""
         params = {"cid": course_id}
 
         if folder_id:
@@ -177,7 +491,7 @@ class Session(object):
         else:
             url = self.url.files_main()
 
-        with self.session.get(url, params=params) as response:
+        def _check_response(response):
             if not response.ok:
                 if response.status_code == 403 and "Documents" in response.text:
                     raise MissingFeatureError("This course has no files")
@@ -186,24 +500,37 @@ class Session(object):
                         "You are missing the required pemissions to view this folder")
                 else:
                     raise DownloadError("Cannot access course files/files_index page")
-            return parsers.extract_files_index_data(response.text)
+
+        return {"url": url, "parse": parsers.extract_files_index_data,
+                "check_response": _check_response, "params": params}
 
     def get_files_index_from_api(self, course_id, folder_id=None):
+        return self.get_parsed(**self.files_index_api_request(course_id, folder_id))
+
+    def files_index_api_request(self, course_id, folder_id=None):
+        """Returns the arguments of get_parsed() for the API listing of a folder"""
         if folder_id:
             url = self.url.files_api_folder(folder_id)
         else:
             url = self.url.files_api_top_folder(course_id)
 
-        with self.session.get(url) as response:
+        def _check_response(response):
             if not response.ok:
-                print(response.text)
-                raise DownloadError("Cannot access course files/files_index page")
+                if response.status_code == 403:
+                    raise MissingPermissionFolderError(
+                        "You are missing the required pemissions to view this folder")
+                raise DownloadError("Cannot access course files/files_index page: " +
+                                    response.text)
+
+        def _parse(text):
+            res = json.loads(text)
 
-            res = json.loads(response.text)
-            
             return res["file_refs"], res["subfolders"]
 
-    def download_media(self, course_id, media_workdir, course_save_as):
+        return {"url": url, "parse": _parse, "check_response": _check_response}
+
+    def find_missing_media(self, course_id, media_workdir, media_index=None):
+        """Returns the url of the media list and the media files which aren't downloaded yet"""
         params = {"cid": course_id}
 
         mediacast_list_url = self.url.mediacast_list()
@@ -219,76 +546,228 @@ class Session(object):
 
         os.makedirs(media_workdir, exist_ok=True)
 
-        workdir_files = os.listdir(media_workdir)
+        # Interrupted downloads are resumed instead of being counted as existing files
+        workdir_files = set(filename for filename in os.listdir(media_workdir)
+                            if not filename.startswith(PARTIAL_FILE_PREFIX))
+        media_hashes = set(media_file["hash"] for media_file in media_files)
+
+        if media_index is None:
+            known_media = {
+                media_hash: {"filename": filename, "state": MEDIA_STATE_COMPLETE}
+                for media_hash, filename, _ in scan_media_dir(media_workdir, workdir_files,
+                                                              media_hashes)
+            }
+        else:
+            if not media_index.is_indexed(course_id, media_workdir):
+                # Files of older versions and of other installations are only known by name
+                media_index.rebuild(course_id, media_workdir,
+                                    scan_media_dir(media_workdir, workdir_files, media_hashes))
+            known_media = media_index.get_course(course_id)
+
+            # Media that is new to the index might still have been downloaded by an older version
+            unknown_hashes = media_hashes - set(known_media)
+            if unknown_hashes:
+                for media_hash, filename, size in scan_media_dir(media_workdir, workdir_files,
+                                                                 unknown_hashes):
+                    media_index.update(course_id, media_hash, filename, size,
+                                       MEDIA_STATE_COMPLETE)
+                    known_media[media_hash] = {"filename": filename,
+                                               "state": MEDIA_STATE_COMPLETE}
 
         print("\tFound {} media files".format(len(media_files)))
 
+        missing_media = []
         for media_file in media_files:
-            media_hash = media_file["hash"]
-            media_type = media_file["type"]
-            media_player_url_relative = media_file["media_url"]
-            media_player_url = urllib.parse.urljoin(mediacast_list_url,
-                                                       media_player_url_relative)
-
             # files are saved as "{filename}-{hash}.{extension}"
             # older version might have used the format "{hash}-{filename}.{extension}"
+            known_file = known_media.get(media_file["hash"])
 
-            found_existing_file = False
+            # Skip this file if it already exists
+            if known_file is not None and known_file["state"] == MEDIA_STATE_COMPLETE and \
+                    known_file["filename"] in workdir_files:
+                continue
 
-            for workdir_filename in workdir_files:
-                workdir_filename_split = workdir_filename.split("-")
+            missing_media.append(media_file)
 
-                if workdir_filename_split[0] == media_hash or \
-                        workdir_filename_split[-1].split(".")[0] == media_hash:
-                    found_existing_file = True
-                    break
+        METRICS.inc("studip_sync_files", len(media_files) - len(missing_media), kind="media",
+                    result="unchanged")
+        # The media list doesn't tell the sizes, they are learned once the downloads start
+        PROGRESS.add_files(len(missing_media))
 
-            # Skip this file if it already exists
-            if found_existing_file:
-                continue
+        return mediacast_list_url, missing_media
 
-            print("\t\tDownloading " + media_hash)
+    def download_media(self, course_id, media_workdir, course_save_as, media_index=None,
+                       jobs=1):
+        mediacast_list_url, missing_media = self.find_missing_media(course_id, media_workdir,
+                                                                    media_index)
 
-            if media_type == "player":
-                with self.session.get(media_player_url) as response:
-                    if not response.ok:
-                        raise DownloadError("Cannot access media file page: " + media_hash)
+        # Up to jobs media files are resolved and downloaded concurrently, the results are still
+        # reported in the order of the list
+        executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+        pending = deque()
 
-                    download_media_url_relative = parsers.extract_media_best_download_link(
-                        response.text)
+        try:
+            for media_file in missing_media:
+                print("\t\tDownloading " + media_file["hash"])
 
-                    download_media_url = urllib.parse.urljoin(media_player_url,
-                                                                 download_media_url_relative)
-            elif media_type == "direct_download":
-                download_media_url = media_player_url
-            else:
-                raise ParserError("media_type is not a valid type")
+                download_args = (course_id, media_file, mediacast_list_url, media_workdir,
+                                 media_index)
 
-            with self.session.get(download_media_url, stream=True) as response:
-                if not response.ok:
-                    print("\t\tCannot download media file: " + str(response))
+                if executor is None:
+                    self._media_download_done(self.download_media_file(*download_args),
+                                              course_save_as)
                     continue
 
-                media_filename = parsers.extract_filename_from_headers(response.headers)
+                pending.append(executor.submit(self.download_media_file, *download_args))
+
+                # Limit the number of queued downloads
+                if len(pending) >= 2 * jobs:
+                    self._media_download_done(pending.popleft().result(), course_save_as)
+
+            while pending:
+                self._media_download_done(pending.popleft().result(), course_save_as)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+    def schedule_media(self, course_id, media_workdir, scheduler, media_index=None):
+        """Submits the missing media files of a course to scheduler and returns the futures"""
+        mediacast_list_url, missing_media = self.find_missing_media(course_id, media_workdir,
+                                                                    media_index)
+
+        futures = []
+        for media_file in missing_media:
+            print("\t\tDownloading " + media_file["hash"])
+
+            # The media list tells neither the size nor the date of a media file
+            futures.append(scheduler.submit(course_id, None, None, self.download_media_file,
+                                            course_id, media_file, mediacast_list_url,
+                                            media_workdir, media_index))
+
+        return futures
+
+    def finish_media(self, futures, course_save_as):
+        """Waits for the media downloads submitted by schedule_media and reports them in order"""
+        for future in futures:
+            self._media_download_done(future.result(), course_save_as)
+
+    def _media_download_done(self, result, course_save_as):
+        media_filename, filepath, transfer, warning = result
+
+        if warning is not None:
+            PROGRESS.file_done()
+            METRICS.inc("studip_sync_files", kind="media", result="failed")
+            print("\t\t" + warning)
+            return
+
+        METRICS.inc("studip_sync_files", kind="media", result="changed")
+
+        print("\t\tDownloaded: {} ({})".format(os.path.basename(filepath), transfer))
+
+        self.plugins.hook_async("hook_file_download_successful", media_filename,
+                                course_save_as, filepath)
+
+    def resolve_media_url(self, media_file, mediacast_list_url, media_index=None):
+        """Returns the download link of a media file and whether it was taken from the index"""
+        media_hash = media_file["hash"]
+        media_type = media_file["type"]
+        media_player_url = urllib.parse.urljoin(mediacast_list_url, media_file["media_url"])
+
+        if media_type == "direct_download":
+            return media_player_url, False
+        elif media_type != "player":
+            raise ParserError("media_type is not a valid type")
+
+        if media_index is not None:
+            download_media_url = media_index.get_resolved_url(media_hash)
+            if download_media_url is not None:
+                return download_media_url, True
+
+        with self.session.get(media_player_url) as response:
+            if not response.ok:
+                raise DownloadError("Cannot access media file page: " + media_hash)
+
+            download_media_url_relative = parsers.extract_media_best_download_link(
+                response.text)
+
+        download_media_url = urllib.parse.urljoin(media_player_url, download_media_url_relative)
+
+        if media_index is not None:
+            media_index.set_resolved_url(media_hash, download_media_url)
+
+        return download_media_url, False
+
+    @staticmethod
+    def _media_size(response, partial):
+        """Returns the size of the whole media file, which might be resumed by response"""
+        content_length = int(response.headers.get("Content-Length") or 0)
+
+        if response.status_code == 206 and os.path.exists(partial.path):
+            return os.path.getsize(partial.path) + content_length
+
+        return content_length
+
+    def download_media_file(self, course_id, media_file, mediacast_list_url, media_workdir,
+                            media_index=None):
+        """Downloads a media file into media_workdir
+
+        Returns the file name sent by the server, the path of the saved file, the measured
+        transfer and a warning, which is only set if the server refused the download.
+        """
+        media_hash = media_file["hash"]
+
+        # An interrupted download is kept and resumed on the next run
+        partial_filename = PARTIAL_FILE_PREFIX + media_hash
+        partial = PartialDownload(os.path.join(media_workdir, partial_filename), media_hash)
+
+        if media_index is not None:
+            media_index.update(course_id, media_hash, partial_filename, 0, MEDIA_STATE_PARTIAL)
+
+        while True:
+            download_media_url, cached = self.resolve_media_url(media_file, mediacast_list_url,
+                                                                media_index)
+
+            def _send(headers):
+                return self.session.get(download_media_url, stream=True, headers=headers)
+
+            # Media files are served from all kinds of urls
+            with METRICS.endpoint("media_download"), \
+                    self.resumed_request(_send, partial) as response:
+                if response.ok:
+                    PROGRESS.learn_size(self._media_size(response, partial))
+                    _, media_size = partial.write(response, bandwidth=self.bandwidth,
+                                                  kind=BANDWIDTH_MEDIA)
+                    break
+
+            # The link might have expired, a cached one is resolved again from the player page
+            if media_index is not None:
+                media_index.forget_resolved_url(media_hash)
+
+            if not cached:
+                return None, None, None, "Cannot download media file: " + str(response)
+
+        # A resumed response might not repeat the headers of the first one
+        media_filename = parsers.extract_filename_from_headers(partial.headers)
+
+        media_filename_split = media_filename.split(".")
+        media_filename_extension = media_filename_split.pop()
+        media_filename_name = ".".join(media_filename_split)
+
+        filename = media_filename_name + "-" + media_hash + "." + media_filename_extension
 
-                media_filename_split = media_filename.split(".")
-                media_filename_extension = media_filename_split.pop()
-                media_filename_name = ".".join(media_filename_split)
+        filepath = os.path.join(media_workdir, filename)
 
-                filename = media_filename_name + "-" + media_hash + "." + media_filename_extension
+        if os.path.exists(filepath):
+            raise FileError(
+                "Cannot access filepath since file already exists: " + filepath)
 
-                filepath = os.path.join(media_workdir, filename)
+        partial.commit(filepath)
 
-                if os.path.exists(filepath):
-                    raise FileError(
-                        "Cannot access filepath since file already exists: " + filepath)
+        if media_index is not None:
+            media_index.update(course_id, media_hash, filename, media_size,
+                               MEDIA_STATE_COMPLETE)
 
-                try:
-                    with open(filepath, "wb") as download_file:
-                        shutil.copyfileobj(response.raw, download_file)
-                except OSError as e:
-                    os.remove(filepath)
-                    raise e
+        # A resumed download only transferred the missing part of the file
+        PROGRESS.file_done(media_size, partial.transfer.size)
 
-                self.plugins.hook("hook_file_download_successful", media_filename, course_save_as,
-                                  filepath)
+        return media_filename, filepath, partial.transfer, None
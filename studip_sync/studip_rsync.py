@@ -1,17 +1,33 @@
+import asyncio
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, redirect_stdout
 from datetime import datetime
 import os
-import shutil
-import tempfile
+import sys
 import time
 import unicodedata
 import string
 
+from studip_sync import async_session
 from studip_sync.arg_parser import ARGS
+from studip_sync.bandwidth import BandwidthLimiter
 from studip_sync.config import CONFIG
+from studip_sync.helpers import OrderedOutput
+from studip_sync.constants import MANIFEST_FILENAME, SYNC_STATE_FILENAME, HTTP_CACHE_FILENAME, \
+    COOKIES_FILENAME, OBJECT_STORE_DIRNAME, MEDIA_INDEX_FILENAME
+from studip_sync.http_cache import HTTPCache
 from studip_sync.logins import LoginError
+from studip_sync.manifest import Manifest
+from studip_sync.media_index import MediaIndex
+from studip_sync.metrics import METRICS
+from studip_sync.object_store import ObjectStore
+from studip_sync.progress import PROGRESS
+from studip_sync.scheduler import DownloadScheduler
+from studip_sync.sync_state import SyncState
 from studip_sync.plugins.plugins import PLUGINS
 from studip_sync.session import Session, DownloadError, MissingFeatureError, \
-    MissingPermissionFolderError
+    MissingPermissionFolderError, PartialDownload, PARTIAL_FILE_PREFIX
 from studip_sync.parsers import ParserError
 
 
@@ -19,7 +35,6 @@ class StudIPRSync(object):
 
     def __init__(self):
         super(StudIPRSync, self).__init__()
-        self.workdir = tempfile.mkdtemp(prefix="studip-sync")
         self.files_destination_dir = CONFIG.files_destination
         self.media_destination_dir = CONFIG.media_destination
 
@@ -28,14 +43,56 @@ class StudIPRSync(object):
         if self.media_destination_dir:
             os.makedirs(self.media_destination_dir, exist_ok=True)
 
-    def sync(self, sync_fully=False, sync_recent=False, use_api=True):
+        self.manifest = None
+        self.sync_state = None
+        if self.files_destination_dir:
+            self.manifest = Manifest(os.path.join(CONFIG.config_dir, MANIFEST_FILENAME))
+            self.sync_state = SyncState(os.path.join(CONFIG.config_dir, SYNC_STATE_FILENAME),
+                                        CONFIG.last_sync)
+
+            if ARGS.rebuild_manifest:
+                self.manifest.clear()
+
+        self.object_store = None
+        if self.files_destination_dir and CONFIG.deduplicate_files:
+            self.object_store = ObjectStore(os.path.join(self.files_destination_dir,
+                                                         OBJECT_STORE_DIRNAME))
+
+        self.media_index = None
+        if self.media_destination_dir:
+            self.media_index = MediaIndex(os.path.join(CONFIG.config_dir, MEDIA_INDEX_FILENAME),
+                                          CONFIG.media_url_ttl)
+
+        self.http_cache = None
+        if CONFIG.http_cache_size:
+            self.http_cache = HTTPCache(os.path.join(CONFIG.config_dir, HTTP_CACHE_FILENAME),
+                                        CONFIG.http_cache_size)
+
+    def sync(self, sync_fully=False, sync_recent=False, use_api=True, jobs=1, file_jobs=1,
+             schedule=None):
         PLUGINS.hook("hook_start")
 
-        with Session(base_url=CONFIG.base_url, plugins=PLUGINS) as session:
+        # The plugins are notified of the downloads in the background, they all have to be
+        # delivered before the sync is over
+        try:
+            return self._sync(sync_fully, sync_recent, use_api, jobs, file_jobs, schedule)
+        finally:
+            PLUGINS.flush()
+
+    def _sync(self, sync_fully, sync_recent, use_api, jobs, file_jobs, schedule):
+        with Session(base_url=CONFIG.base_url, plugins=PLUGINS, pool_size=jobs * file_jobs,
+                     cache=self.http_cache,
+                     bandwidth=BandwidthLimiter.from_config(CONFIG.bandwidth)) as session:
             print("Logging in...")
+            cookie_file = os.path.join(CONFIG.config_dir, COOKIES_FILENAME)
             try:
-                session.login(CONFIG.auth_type, CONFIG.auth_type_data, CONFIG.username,
-                              CONFIG.password)
+                with METRICS.timer("login"):
+                    if session.restore_login(cookie_file, CONFIG.username):
+                        print("Reusing the session of the last sync")
+                    else:
+                        session.login(CONFIG.auth_type, CONFIG.auth_type_data, CONFIG.username,
+                                      CONFIG.password)
+                        session.save_login(cookie_file, CONFIG.username)
             except (LoginError, ParserError) as e:
                 print("Login failed!")
                 print(e)
@@ -44,7 +101,8 @@ class StudIPRSync(object):
             print("Downloading course list...")
 
             try:
-                courses = list(session.get_courses(sync_recent))
+                with METRICS.timer("courses"):
+                    courses = list(session.get_courses(sync_recent))
             except (LoginError, ParserError) as e:
                 print("Downloading course list failed!")
                 print(e)
@@ -53,57 +111,194 @@ class StudIPRSync(object):
             if sync_recent:
                 print("Syncing only the most recent semester!")
 
+            scheduler = None
+            if schedule:
+                scheduler = DownloadScheduler(jobs * file_jobs, schedule)
+
             status_code = 0
-            for i in range(0, len(courses)):
-                course = courses[i]
-                print("{}) {}: {}".format(i + 1, course["semester"], course["save_as"]))
+            try:
+                for course_status_code, media_error in self.sync_courses(
+                        session, courses, sync_fully, use_api, jobs, file_jobs, scheduler):
+                    if media_error is not None and status_code != 0:
+                        raise media_error
 
-                course_save_as = get_course_save_as(course)
+                    if course_status_code != 0:
+                        status_code = course_status_code
+            finally:
+                if scheduler is not None:
+                    scheduler.shutdown(wait=True, cancel_futures=True)
 
-                if self.files_destination_dir:
-                    try:
-                        files_root_dir = os.path.join(self.files_destination_dir, course_save_as)
+        if self.files_destination_dir and status_code == 0:
+            CONFIG.update_last_sync(int(time.time()))
 
-                        CourseRSync(session, self.workdir, files_root_dir, course,
-                                    sync_fully, use_api).download()
-                    except MissingFeatureError:
-                        # Ignore if there are no files
-                        pass
-                    except DownloadError as e:
-                        print("\tDownload of files failed: " + str(e))
-                        status_code = 2
-                        raise e
+        return status_code
+
+    def sync_courses(self, session, courses, sync_fully, use_api, jobs=1, file_jobs=1,
+                     scheduler=None):
+        if scheduler is not None:
+            return self.sync_courses_scheduled(session, courses, sync_fully, use_api, file_jobs,
+                                               scheduler)
+
+        if jobs <= 1:
+            return (self.sync_course(session, i, course, sync_fully, use_api, file_jobs)
+                    for i, course in enumerate(courses))
+
+        # Every course prints into its own buffer, which is released in the original course
+        # order as soon as the course and all courses before it have finished
+        output = OrderedOutput(sys.stdout)
+        executor = ThreadPoolExecutor(max_workers=jobs)
 
-                if self.media_destination_dir:
+        with redirect_stdout(output):
+            futures = [executor.submit(output.capture, i, self.sync_course, session, i, course,
+                                       sync_fully, use_api, file_jobs)
+                       for i, course in enumerate(courses)]
+
+            results = []
+            try:
+                for i, future in enumerate(futures):
                     try:
-                        print("\tSyncing media files...")
+                        results.append(future.result())
+                    finally:
+                        output.release(i)
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
 
-                        media_root_dir = os.path.join(self.media_destination_dir,
-                                                      course_save_as)
+        return results
 
-                        session.download_media(course["course_id"], media_root_dir,
-                                               course["save_as"])
-                    except MissingFeatureError:
-                        # Ignore if there is no media
-                        pass
-                    except DownloadError as e:
-                        print("\tDownload of media failed: " + str(e))
-                        status_code = 2
-                        raise e
-                    except ParserError as e:
-                        print("\tDownload of media failed: " + str(e))
-                        if status_code != 0:
-                            raise e
-                        else:
-                            status_code = 2
+    def sync_course(self, session, i, course, sync_fully, use_api, file_jobs=1):
+        pending_course = self.discover_course(session, i, course, sync_fully, use_api, file_jobs)
+        return self.finish_course(session, pending_course)
 
-        if self.files_destination_dir and status_code == 0:
-            CONFIG.update_last_sync(int(time.time()))
+    def sync_courses_scheduled(self, session, courses, sync_fully, use_api, file_jobs, scheduler):
+        """Finds the downloads of all courses before waiting for any of them
 
-        return status_code
+        The scheduler can only order the downloads across courses if it knows about them, so all
+        courses are listed first. The downloads start right away and the results are collected
+        course by course afterwards.
+        """
+        with METRICS.timer("discovery"):
+            pending_courses = [self.discover_course(session, i, course, sync_fully, use_api,
+                                                    file_jobs, scheduler)
+                               for i, course in enumerate(courses)]
+
+        print("Waiting for downloads...")
+
+        for pending_course in pending_courses:
+            with METRICS.timer("downloads"):
+                result = self.finish_course(session, pending_course)
+            yield result
+
+    def discover_course(self, session, i, course, sync_fully, use_api, file_jobs=1,
+                        scheduler=None):
+        """Finds the new files of a course and submits their downloads
+
+        Without a scheduler, the files are downloaded by the course itself and the media files
+        are only downloaded by finish_course().
+        """
+        print("{}) {}: {}".format(i + 1, course["semester"], course["save_as"]))
+
+        course_save_as = get_course_save_as(course)
+        pending_course = PendingCourse(i, course, file_jobs, scheduler is not None)
+
+        if self.files_destination_dir:
+            with self.files_errors(), METRICS.timer("files"):
+                files_root_dir = os.path.join(self.files_destination_dir, course_save_as)
+
+                # Files changed while this course is synced are picked up by the next sync
+                sync_started = int(time.time())
+
+                course_rsync = CourseRSync(session, files_root_dir, course, sync_fully, use_api,
+                                           file_jobs, self.manifest, self.sync_state,
+                                           self.object_store, scheduler)
+                if course_rsync.discover():
+                    pending_course.course_rsync = course_rsync
+
+                pending_course.sync_started = sync_started
+
+        if self.media_destination_dir and scheduler is not None:
+            with self.media_errors(pending_course), METRICS.timer("media"):
+                print("\tSyncing media files...")
+
+                pending_course.media_futures = session.schedule_media(
+                    course["course_id"], self.media_root_dir(course), scheduler,
+                    self.media_index)
+
+        return pending_course
+
+    def finish_course(self, session, pending_course):
+        """Waits for the downloads of a course found by discover_course() and reports them"""
+        course = pending_course.course
+
+        # The header of a scheduled course was printed long before, while all courses were listed
+        if pending_course.scheduled and pending_course.has_downloads():
+            print("{}) {}: {}".format(pending_course.i + 1, course["semester"],
+                                      course["save_as"]))
+
+        if pending_course.course_rsync is not None:
+            with self.files_errors(), METRICS.timer("files"):
+                pending_course.course_rsync.finish()
+
+        if pending_course.sync_started is not None:
+            self.sync_state.update_last_sync(course["course_id"], pending_course.sync_started)
+
+        if self.media_destination_dir:
+            with self.media_errors(pending_course), METRICS.timer("media"):
+                if pending_course.scheduled:
+                    session.finish_media(pending_course.media_futures, course["save_as"])
+                else:
+                    print("\tSyncing media files...")
+
+                    session.download_media(course["course_id"], self.media_root_dir(course),
+                                           course["save_as"], self.media_index,
+                                           pending_course.file_jobs)
+
+        return pending_course.status_code, pending_course.media_error
+
+    def media_root_dir(self, course):
+        return os.path.join(self.media_destination_dir, get_course_save_as(course))
+
+    @staticmethod
+    @contextmanager
+    def files_errors():
+        try:
+            yield
+        except MissingFeatureError:
+            # Ignore if there are no files
+            pass
+        except DownloadError as e:
+            print("\tDownload of files failed: " + str(e))
+            raise e
+
+    @staticmethod
+    @contextmanager
+    def media_errors(pending_course):
+        try:
+            yield
+        except MissingFeatureError:
+            # Ignore if there is no media
+            pass
+        except DownloadError as e:
+            print("\tDownload of media failed: " + str(e))
+            raise e
+        except ParserError as e:
+            print("\tDownload of media failed: " + str(e))
+            # Whether this error aborts the sync depends on the status of the courses
+            # before, so it is only decided once the results are collected in order
+            pending_course.status_code = 2
+            pending_course.media_error = e
 
     def cleanup(self):
-        shutil.rmtree(self.workdir)
+        if self.manifest:
+            self.manifest.close()
+
+        if self.sync_state:
+            self.sync_state.close()
+
+        if self.media_index:
+            self.media_index.close()
+
+        if self.http_cache:
+            self.http_cache.close()
 
     def __enter__(self):
         return self
@@ -115,12 +310,15 @@ class StudIPRSync(object):
 UNICODE_NORMALIZE_MODE = "NFKC"
 
 
-def check_and_cleanup_form_data(form_data_files, form_data_folders, use_api):
+def check_and_cleanup_form_data(form_data_files, form_data_folders, use_api, log_message=None):
+    if log_message is None:
+        log_message = log
+
     form_data_files_new = []
     for form_data in form_data_files:
         try:
             if "id" not in form_data:
-                log("Skipped file that can't be downloaded: {}".format(form_data["name"]))
+                log_message("Skipped file that can't be downloaded: {}".format(form_data["name"]))
                 continue
                 
             form_id = form_data["id"]
@@ -131,12 +329,12 @@ def check_and_cleanup_form_data(form_data_files, form_data_folders, use_api):
             # TODO: support links by saving them as .url files
             if "size" not in form_data or form_data["size"] is None or ("storage" in form_data and form_data["storage"] == "url") or ("icon" in form_data and form_data["icon"] == "link-extern"):
                 if ARGS.v:
-                    print("[Debug] " + str(form_data))
-                log("Found unsupported file: {}".format(form_data["name"]))
+                    log_message("[Debug] " + str(form_data))
+                log_message("Found unsupported file: {}".format(form_data["name"]))
                 continue
 
             if use_api and "is_downloadable" in form_data and not form_data["is_downloadable"]:
-                log("Skipped file that can't be downloaded: {}".format(form_data["name"]))
+                log_message("Skipped file that can't be downloaded: {}".format(form_data["name"]))
                 continue
 
             new_file_data = {
@@ -149,16 +347,20 @@ def check_and_cleanup_form_data(form_data_files, form_data_folders, use_api):
             if not use_api:
                 new_file_data["download_url"] = form_data["download_url"]
 
+            # Id of the underlying file, copies of a file in other courses share it
+            content_id = form_data.get("file_id")
+            if content_id and all(c in string.hexdigits for c in content_id):
+                new_file_data["file_id"] = content_id
+
             form_data_files_new.append(new_file_data)
         except Exception as e:
-            print(form_data)
-            raise ParserError("File attributes are invalid: {}".format(e))
+            raise ParserError("File attributes are invalid: {}: {}".format(e, form_data))
 
     form_data_folders_new = []
     for form_data in form_data_folders:
         try:
             if "id" not in form_data:
-                log("Skipped folder that can't be downloaded")
+                log_message("Skipped folder that can't be downloaded")
                 continue
             form_id = form_data["id"]
             if not all(c in string.hexdigits for c in form_id):
@@ -169,8 +371,7 @@ def check_and_cleanup_form_data(form_data_files, form_data_folders, use_api):
                 "id": form_id
             })
         except Exception as e:
-            print(form_data)
-            raise ParserError("Folder attributes are invalid: {}".format(e))
+            raise ParserError("Folder attributes are invalid: {}: {}".format(e, form_data))
 
     return form_data_files_new, form_data_folders_new
 
@@ -209,6 +410,39 @@ def is_file_new(file, file_path):
     return False
 
 
+def is_file_new_in_manifest(file, file_path, entry, folder_entries):
+    """Checks a file against its manifest entry instead of the file on disk
+
+    Returns None if there is no usable entry, in that case is_file_new has to decide.
+    """
+    if not file["size"]:
+        # If there is no size, skip this file, since it cant be downloaded
+        return False
+
+    if entry is None or entry["path"] != file_path or \
+            os.path.basename(file_path) not in folder_entries:
+        return None
+
+    chdate = file["chdate"]
+    if chdate > entry["chdate"]:
+        log("File changed: time: {} - {} : {}".format(chdate, entry["chdate"], file_path))
+        return True
+
+    size = file["size"]
+    if not size == entry["size"]:
+        log("File changed: size: {} - {} : {}".format(size, entry["size"], file_path))
+        return True
+
+    return False
+
+
+def list_folder(folder):
+    try:
+        return set(os.listdir(folder))
+    except FileNotFoundError:
+        return set()
+
+
 def get_course_save_as(course):
     if CONFIG.use_new_file_structure:
         save_as_semester = course["semester"].replace("/", "--")
@@ -219,85 +453,406 @@ def get_course_save_as(course):
         return course["save_as"]
 
 
+class PendingCourse(object):
+    """Course whose downloads were submitted, but not collected yet"""
+
+    def __init__(self, i, course, file_jobs=1, scheduled=False):
+        super(PendingCourse, self).__init__()
+        self.i = i
+        self.course = course
+        self.file_jobs = file_jobs
+        self.scheduled = scheduled
+        self.course_rsync = None
+        self.sync_started = None
+        self.media_futures = []
+        self.status_code = 0
+        self.media_error = None
+
+    def has_downloads(self):
+        return bool(self.media_futures) or \
+            (self.course_rsync is not None and bool(self.course_rsync.pending))
+
+
 class CourseRSync:
 
-    def __init__(self, session, workdir, root_folder, course, sync_fully, use_api):
+    def __init__(self, session, root_folder, course, sync_fully, use_api, file_jobs=1,
+                 manifest=None, sync_state=None, object_store=None, scheduler=None):
         self.session = session
-        self.workdir = workdir
         self.course_id = course["course_id"]
         self.course_save_as = course["save_as"]
         self.root_folder = root_folder
         self.sync_fully = sync_fully
         self.use_api = use_api
+        self.file_jobs = file_jobs
+        self.manifest = manifest
+        self.sync_state = sync_state
+        self.object_store = object_store
+        self.scheduler = scheduler
+        self.executor = None
+        self.pending = deque()
+        self.pending_paths = {}
 
     def download(self):
-        if self.course_has_new_files(self.sync_fully):
-            print("\tSyncing files...")
+        if self.discover():
+            self.finish()
+
+    def discover(self):
+        """Finds the new files of the course and submits their downloads
+
+        Returns False if the course is skipped. The downloads still have to be collected with
+        finish().
+        """
+        if not self.course_has_new_files(self.sync_fully):
+            print("\tSkipping this course...")
+            return False
+
+        print("\tSyncing files...")
+
+        if self.scheduler is None and self.file_jobs > 1:
+            self.executor = ThreadPoolExecutor(max_workers=self.file_jobs)
+
+        try:
             self.download_recursive()
+        except BaseException:
+            self.shutdown()
+            raise
+
+        return True
+
+    def finish(self):
+        try:
+            self.collect_downloads()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True, cancel_futures=True)
+            self.executor = None
+
+    def submit_download(self, file_data, file_path):
+        file_size = int(file_data["size"])
+        PROGRESS.add_files(1, file_size)
+
+        if self.executor is None and self.scheduler is None:
+            try:
+                transfer = self.download_file(file_data, file_path)
+            except Exception:
+                self.download_failed()
+                raise
+
+            self.report_download(file_path, file_size, transfer)
+            return
+
+        # Files with the same path have to be written in the order they were found, otherwise the
+        # .old rotation could keep the wrong version
+        previous = self.pending_paths.get(file_path)
+        if previous is not None:
+            self.collect_downloads(until=previous)
+
+        if self.scheduler is not None:
+            future = self.scheduler.submit(self.course_id, file_size,
+                                           file_data.get("chdate"), self.download_file,
+                                           file_data, file_path)
         else:
-            print("\tSkipping this course...")
+            future = self.executor.submit(self.download_file, file_data, file_path)
+
+        self.pending.append((future, file_path, file_size))
+        self.pending_paths[file_path] = future
+
+        # Limit the number of queued downloads, the scheduler has to know all of them instead
+        if self.executor is not None and len(self.pending) >= 2 * self.file_jobs:
+            self.collect_downloads(until=self.pending[0][0])
+
+    def collect_downloads(self, until=None):
+        """Waits for the pending downloads up to until, or for all of them, and reports them
+
+        Downloads are only collected at these fixed points and always in the order the files
+        were found, so the log and the first failed file don't depend on the order the downloads
+        finished in.
+        """
+        while self.pending:
+            future, file_path, file_size = self.pending[0]
+
+            try:
+                transfer = future.result()
+            except Exception:
+                self.download_failed()
+                raise
+
+            self.report_download(file_path, file_size, transfer)
+            self.pending.popleft()
+
+            if self.pending_paths.get(file_path) is future:
+                del self.pending_paths[file_path]
+
+            if future is until:
+                return
+
+    def report_download(self, file_path, file_size, transfer):
+        METRICS.inc("studip_sync_files", kind="files", result="changed")
+
+        # Linked and resumed files weren't transferred completely
+        PROGRESS.file_done(file_size, transfer.size if transfer is not None else 0)
+
+        # Files of the same name in different folders are told apart by their path
+        path = os.path.relpath(file_path, self.root_folder)
+        if transfer is None:
+            log("Linked stored content: {}".format(path))
+        else:
+            log("Downloaded: {} ({})".format(path, transfer))
+
+    @staticmethod
+    def download_failed():
+        METRICS.inc("studip_sync_files", kind="files", result="failed")
+        PROGRESS.file_done()
+
+    def download_file(self, file_data, file_path):
+        """Downloads a file to file_path and returns the measured transfer
+
+        Returns None if the file was linked to stored content instead. This runs on the worker
+        threads, so the result is only logged by report_download() on the course thread.
+        """
+        file_path_base, file_path_name = os.path.split(file_path)
+        os.makedirs(file_path_base, exist_ok=True)
+
+        file_size = int(file_data["size"])
+
+        partial = None
+        content_hash = self.find_stored_content(file_data)
+        if content_hash is not None:
+            self.keep_old_version(file_path)
+            self.object_store.link(content_hash, file_path)
+        else:
+            # The file is downloaded next to its destination, so it can be moved into place
+            # with a rename instead of being copied again
+            partial = PartialDownload(os.path.join(file_path_base,
+                                                   PARTIAL_FILE_PREFIX + file_data["id"]),
+                                      file_data["name"])
+
+            if not self.use_api:
+                content_hash, target_file_size = self.session.download_file(
+                    file_data["download_url"], partial, file_size)
+            else:
+                content_hash, target_file_size = self.session.download_file_api(
+                    file_data["id"], partial, file_size)
+
+            if target_file_size != file_size:
+                partial.discard()
+                message = "File size didn't match expected file size: " + file_path
+                if ARGS.v:
+                    message += " [Debug] " + str(file_data)
+                raise DownloadError(message)
+
+            self.keep_old_version(file_path)
+            partial.commit(file_path)
+
+            if self.object_store:
+                self.object_store.add(file_path, content_hash)
+
+        if self.manifest:
+            self.manifest.update(file_data["id"], file_path, file_data["chdate"], file_size,
+                                 content_hash, file_data.get("file_id"))
+
+        self.session.plugins.hook_async("hook_file_download_successful", file_data["name"],
+                                        self.course_save_as, file_path)
+
+        return partial.transfer if partial is not None else None
+
+    def find_stored_content(self, file_data):
+        """Returns the hash of the stored content of a file that was already downloaded before"""
+        if not self.object_store or not self.manifest or not file_data.get("file_id"):
+            return None
+
+        entry = self.manifest.find_content(file_data["file_id"], file_data["size"],
+                                           file_data["chdate"])
+        if entry is None or not self.object_store.has(entry["hash"], entry["size"]):
+            return None
+
+        return entry["hash"]
+
+    @staticmethod
+    def keep_old_version(file_path):
+        if not os.path.exists(file_path):
+            return
+
+        timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
+        suffix = "_" + timestr + ".old"
+
+        # Keep the old version as a hard link, so the file never disappears from file_path
+        try:
+            os.link(file_path, file_path + suffix)
+        except OSError:
+            os.rename(file_path, file_path + suffix)
 
     def course_has_new_files(self, sync_fully=False):
         if sync_fully:
             return True
 
-        return self.session.check_course_new_files(self.course_id, CONFIG.last_sync)
+        if self.sync_state:
+            last_sync = self.sync_state.last_sync(self.course_id)
+        else:
+            last_sync = CONFIG.last_sync
 
-    def download_recursive(self, folder_id=None, folder_path_relative=""):
-        try:
-            if self.use_api:
-                form_data_files, form_data_folders = self.session.get_files_index_from_api(self.course_id,
-                                                                              folder_id)
-            else:
-                form_data_files, form_data_folders = self.session.get_files_index(self.course_id,
-                                                                              folder_id)
-        except MissingPermissionFolderError:
-            log("Couldn't view the following folder because of missing permissions: " + folder_path_relative)
+        return self.session.check_course_new_files(self.course_id, last_sync)
+
+    def download_recursive(self, folder=None):
+        if folder is None:
+            folder = CourseTreeCrawler(self.session, self.course_id, self.use_api,
+                                       self.file_jobs).crawl()
+
+        for message in folder.messages:
+            log(message)
+
+        if folder.missing_permission:
+            log("Couldn't view the following folder because of missing permissions: " +
+                folder.path_relative)
             return
 
-        form_data_files, form_data_folders = check_and_cleanup_form_data(form_data_files,
-                                                                         form_data_folders, self.use_api)
+        folder_absolute = os.path.join(self.root_folder, folder.path_relative)
+
+        # A single listing of the folder replaces the per-file existence checks
+        folder_entries = list_folder(folder_absolute) if self.manifest else None
+        rebuilt_entries = []
 
-        for file_data in form_data_files:
-            folder_absolute = os.path.join(self.root_folder, folder_path_relative)
+        for file_data in folder.files:
             file_path = os.path.join(folder_absolute, file_data["name"])
-            if is_file_new(file_data, file_path):
+
+            if self.manifest:
+                file_new = is_file_new_in_manifest(file_data, file_path,
+                                                   self.manifest.get(file_data["id"]),
+                                                   folder_entries)
+                if file_new is None:
+                    # Manifest is missing or stale for this file, so check the file on disk
+                    file_new = is_file_new(file_data, file_path)
+
+                    if not file_new:
+                        rebuilt_entries.append((file_data["id"], file_path, file_data["chdate"],
+                                                file_data["size"], None,
+                                                file_data.get("file_id")))
+            else:
+                file_new = is_file_new(file_data, file_path)
+
+            if file_new:
                 log("Downloading: {}: {}".format(file_data["id"], file_data["name"]))
 
-                target_file = os.path.join(self.workdir, file_data["id"])
+                self.submit_download(file_data, file_path)
+            else:
+                METRICS.inc("studip_sync_files", kind="files", result="unchanged")
 
-                if not self.use_api:
-                    self.session.download_file(file_data["download_url"], target_file)
-                else:
-                    self.session.download_file_api(file_data["id"], target_file)
-
-                file_size = int(file_data["size"])
-                target_file_size = os.path.getsize(target_file)
-                if target_file_size != file_size:
-                    if ARGS.v:
-                        print("[Debug] " + str(form_data_files))
-                    raise DownloadError("File size didn't match expected file size: " + file_path)
-
-                file_path_base, file_path_name = os.path.split(file_path)
-                if os.path.exists(file_path):
-                    timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
-                    suffix = "_" + timestr + ".old"
-                    new_file_path = os.path.join(file_path_base, file_path_name + suffix)
-                    os.rename(file_path, new_file_path)
+        if rebuilt_entries:
+            self.manifest.update_many(rebuilt_entries)
+
+        for subfolder in folder.subfolders:
+            self.download_recursive(subfolder)
+
+
+class FolderNode(object):
+
+    def __init__(self, folder_id, path_relative):
+        super(FolderNode, self).__init__()
+        self.folder_id = folder_id
+        self.path_relative = path_relative
+        self.files = []
+        self.subfolders = []
+        self.missing_permission = False
+        # Log messages are kept with the folder, so that they can be printed in order later on
+        self.messages = []
+
+
+class CourseTreeCrawler(object):
+    """Fetches the complete folder tree of a course before any file is downloaded
+
+    With more than one job, all folders of one level are listed concurrently on jobs threads, so
+    a course only costs one round trip per level of its folder tree instead of one per folder.
+    If aiohttp is installed, every folder is listed as soon as its parent folder is known instead,
+    with up to jobs requests in flight from a single thread.
+    """
+
+    def __init__(self, session, course_id, use_api, jobs=1):
+        super(CourseTreeCrawler, self).__init__()
+        self.session = session
+        self.course_id = course_id
+        self.use_api = use_api
+        self.jobs = jobs
+
+    def crawl(self):
+        if self.jobs > 1 and async_session.is_available():
+            return asyncio.run(self.crawl_async())
+
+        root = FolderNode(None, "")
+        level = [root]
+
+        executor = ThreadPoolExecutor(max_workers=self.jobs) if self.jobs > 1 else None
+
+        try:
+            while level:
+                if executor is None:
+                    for folder in level:
+                        self.fetch_folder(folder)
                 else:
-                    os.makedirs(file_path_base, exist_ok=True)
+                    # Consuming the results re-raises the first error in folder order
+                    for _ in executor.map(self.fetch_folder, level):
+                        pass
+
+                level = [subfolder for folder in level for subfolder in folder.subfolders]
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
+
+        return root
+
+    async def crawl_async(self):
+        root = FolderNode(None, "")
+
+        async with async_session.AsyncSession(self.session, self.jobs) as session:
+            await self.fetch_tree_async(session, root)
+
+        return root
+
+    async def fetch_tree_async(self, session, folder):
+        try:
+            if self.use_api:
+                form_data = await session.get_files_index_from_api(self.course_id,
+                                                                   folder.folder_id)
+            else:
+                form_data = await session.get_files_index(self.course_id, folder.folder_id)
+        except MissingPermissionFolderError:
+            folder.missing_permission = True
+            return
+
+        self.add_folder_contents(folder, *form_data)
+
+        results = await asyncio.gather(*(self.fetch_tree_async(session, subfolder)
+                                         for subfolder in folder.subfolders),
+                                       return_exceptions=True)
 
-                if os.path.exists(file_path):
-                    raise DownloadError("File exists already, even after moving it away: " +
-                                        file_path)
+        # Like the threaded crawl, the first error in folder order is raised
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
 
-                shutil.copyfile(target_file, file_path)
+    def fetch_folder(self, folder):
+        try:
+            if self.use_api:
+                form_data_files, form_data_folders = self.session.get_files_index_from_api(
+                    self.course_id, folder.folder_id)
+            else:
+                form_data_files, form_data_folders = self.session.get_files_index(
+                    self.course_id, folder.folder_id)
+        except MissingPermissionFolderError:
+            # Only this subtree is skipped, the rest of the course is still crawled
+            folder.missing_permission = True
+            return
 
-                self.session.plugins.hook("hook_file_download_successful", file_data["name"],
-                                          self.course_save_as, file_path)
+        self.add_folder_contents(folder, form_data_files, form_data_folders)
 
-        for folder_data in form_data_folders:
-            new_folder_path_relative = os.path.join(folder_path_relative, folder_data["name"])
+    def add_folder_contents(self, folder, form_data_files, form_data_folders):
+        form_data_files, form_data_folders = check_and_cleanup_form_data(
+            form_data_files, form_data_folders, self.use_api, folder.messages.append)
 
-            # self.log("Accessing folder: " + folder_data["id"] + ": " + folder_data["name"])
-            self.download_recursive(folder_data["id"], new_folder_path_relative)
+        folder.files = form_data_files
+        folder.subfolders = [
+            FolderNode(folder_data["id"], os.path.join(folder.path_relative, folder_data["name"]))
+            for folder_data in form_data_folders
+        ]
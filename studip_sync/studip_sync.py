@@ -1,17 +1,31 @@
 import shutil
 import os
 import tempfile
-import zipfile
 import glob
-import subprocess
+import json
 import time
-from datetime import datetime
 
+from studip_sync.arg_parser import ARGS
+from studip_sync.bandwidth import BandwidthLimiter
 from studip_sync.config import CONFIG
+from studip_sync.constants import SYNC_STATE_FILENAME, HTTP_CACHE_FILENAME, COOKIES_FILENAME, \
+    HASH_CACHE_FILENAME, CRC_INDEX_FILENAME, MEDIA_INDEX_FILENAME
+from studip_sync.crc_index import CRCIndex
+from studip_sync.hash_cache import HashCache
+from studip_sync.http_cache import HTTPCache
 from studip_sync.logins import LoginError
+from studip_sync.media_index import MediaIndex
+from studip_sync.metrics import METRICS
 from studip_sync.plugins.plugins import PLUGINS
-from studip_sync.session import Session, DownloadError, MissingFeatureError
+from studip_sync.session import Session, DownloadError, MissingFeatureError, \
+    PARTIAL_FILE_PREFIX
 from studip_sync.parsers import ParserError
+from studip_sync.sync_state import SyncState
+from studip_sync.tree_sync import TreeSync
+from studip_sync.zip_stream import ZipStreamReader, ZipStreamError
+
+
+FILELIST_FILENAME = "archive_filelist.csv"
 
 
 class ExtractionError(Exception):
@@ -23,29 +37,61 @@ class StudipSync(object):
     def __init__(self):
         super(StudipSync, self).__init__()
         self.workdir = tempfile.mkdtemp(prefix="studip-sync")
-        self.download_dir = os.path.join(self.workdir, "zips")
         self.extract_dir = os.path.join(self.workdir, "extracted")
         self.files_destination_dir = CONFIG.files_destination
         self.media_destination_dir = CONFIG.media_destination
 
-        os.makedirs(self.download_dir)
         os.makedirs(self.extract_dir)
         if self.files_destination_dir:
             os.makedirs(self.files_destination_dir, exist_ok=True)
         if self.media_destination_dir:
             os.makedirs(self.media_destination_dir, exist_ok=True)
 
+        self.sync_state = None
+        self.hash_cache = None
+        self.crc_index = None
+        if self.files_destination_dir:
+            self.sync_state = SyncState(os.path.join(CONFIG.config_dir, SYNC_STATE_FILENAME),
+                                        CONFIG.last_sync)
+            self.hash_cache = HashCache(os.path.join(CONFIG.config_dir, HASH_CACHE_FILENAME))
+            self.crc_index = CRCIndex(os.path.join(CONFIG.config_dir, CRC_INDEX_FILENAME))
+
+        self.media_index = None
+        if self.media_destination_dir:
+            self.media_index = MediaIndex(os.path.join(CONFIG.config_dir, MEDIA_INDEX_FILENAME),
+                                          CONFIG.media_url_ttl)
+
+        self.http_cache = None
+        if CONFIG.http_cache_size:
+            self.http_cache = HTTPCache(os.path.join(CONFIG.config_dir, HTTP_CACHE_FILENAME),
+                                        CONFIG.http_cache_size)
+
     def sync(self, sync_fully=False, sync_recent=False):
         PLUGINS.hook("hook_start")
 
-        extractor = Extractor(self.extract_dir)
-        rsync = RsyncWrapper()
+        # The plugins are notified of the downloads in the background, they all have to be
+        # delivered before the sync is over
+        try:
+            return self._sync(sync_fully, sync_recent)
+        finally:
+            PLUGINS.flush()
 
-        with Session(base_url=CONFIG.base_url, plugins=PLUGINS) as session:
+    def _sync(self, sync_fully, sync_recent):
+        extractor = Extractor(self.extract_dir, self.crc_index, self.files_destination_dir)
+        tree_sync = TreeSync(self.hash_cache)
+
+        with Session(base_url=CONFIG.base_url, plugins=PLUGINS, cache=self.http_cache,
+                     bandwidth=BandwidthLimiter.from_config(CONFIG.bandwidth)) as session:
             print("Logging in...")
+            cookie_file = os.path.join(CONFIG.config_dir, COOKIES_FILENAME)
             try:
-                session.login(CONFIG.auth_type, CONFIG.auth_type_data, CONFIG.username,
-                              CONFIG.password)
+                with METRICS.timer("login"):
+                    if session.restore_login(cookie_file, CONFIG.username):
+                        print("Reusing the session of the last sync")
+                    else:
+                        session.login(CONFIG.auth_type, CONFIG.auth_type_data, CONFIG.username,
+                                      CONFIG.password)
+                        session.save_login(cookie_file, CONFIG.username)
             except (LoginError, ParserError) as e:
                 print("Login failed!")
                 print(e)
@@ -54,7 +100,8 @@ class StudipSync(object):
             print("Downloading course list...")
 
             try:
-                courses = list(session.get_courses(sync_recent))
+                with METRICS.timer("courses"):
+                    courses = list(session.get_courses(sync_recent))
             except (LoginError, ParserError) as e:
                 print("Downloading course list failed!")
                 print(e)
@@ -64,19 +111,30 @@ class StudipSync(object):
                 print("Syncing only the most recent semester!")
 
             status_code = 0
+            # Courses are only marked as synced once their files were copied into place
+            synced_courses = []
             for i in range(0, len(courses)):
                 course = courses[i]
                 print("{}) {}: {}".format(i+1, course["semester"], course["save_as"]))
 
                 if self.files_destination_dir:
                     try:
-                        if sync_fully or session.check_course_new_files(course["course_id"], CONFIG.last_sync):
+                        sync_started = int(time.time())
+                        last_sync = self.sync_state.last_sync(course["course_id"])
+
+                        if sync_fully or session.check_course_new_files(course["course_id"], last_sync):
                             print("\tDownloading files...")
-                            zip_location = session.download(
-                                course["course_id"], self.download_dir, course.get("sync_only"))
-                            extractor.extract(zip_location, course["save_as"])
+                            with METRICS.timer("files"), \
+                                    session.stream_download(course["course_id"],
+                                                            course.get("sync_only")) as stream:
+                                extractor.extract_stream(stream, course["save_as"],
+                                                         course_id=course["course_id"],
+                                                         skip_unchanged=not sync_fully)
+                            print("\tDownloaded {}".format(stream.transfer))
                         else:
                             print("\tSkipping this course...")
+
+                        synced_courses.append((course["course_id"], sync_started))
                     except MissingFeatureError:
                         # Ignore if there are no files
                         pass
@@ -93,7 +151,9 @@ class StudipSync(object):
 
                         media_course_dir = os.path.join(self.media_destination_dir, course["save_as"])
 
-                        session.download_media(course["course_id"], media_course_dir, course["save_as"])
+                        with METRICS.timer("media"):
+                            session.download_media(course["course_id"], media_course_dir,
+                                                   course["save_as"], self.media_index)
                     except MissingFeatureError:
                         # Ignore if there is no media
                         pass
@@ -109,16 +169,57 @@ class StudipSync(object):
 
         if self.files_destination_dir:
             print("Synchronizing with existing files...")
-            rsync.sync(self.extract_dir + "/", self.files_destination_dir)
+            with METRICS.timer("tree_sync"):
+                changes = tree_sync.sync(self.extract_dir, self.files_destination_dir,
+                                         extractor.changed_paths)
+
+            for change in changes:
+                METRICS.inc("studip_sync_files", kind="files",
+                            result="failed" if change["action"] == "failed" else "changed")
+
+            if ARGS.change_list:
+                self.write_change_list(ARGS.change_list, changes)
+
+            extractor.commit_index(changes)
+
+            if any(change["action"] == "failed" for change in changes):
+                status_code = 2
+            else:
+                for course_id, sync_started in synced_courses:
+                    self.sync_state.update_last_sync(course_id, sync_started)
 
             if status_code == 0:
                 CONFIG.update_last_sync(int(time.time()))
 
         return status_code
 
+    def write_change_list(self, path, changes):
+        change_list = {
+            "destination": self.files_destination_dir,
+            "changes": changes
+        }
+
+        with open(path, "w") as file:
+            json.dump(change_list, file, indent=4)
+
     def cleanup(self):
         shutil.rmtree(self.workdir)
 
+        if self.sync_state:
+            self.sync_state.close()
+
+        if self.hash_cache:
+            self.hash_cache.close()
+
+        if self.crc_index:
+            self.crc_index.close()
+
+        if self.media_index:
+            self.media_index.close()
+
+        if self.http_cache:
+            self.http_cache.close()
+
     def __enter__(self):
         return self
 
@@ -126,36 +227,44 @@ class StudipSync(object):
         self.cleanup()
 
 
-# pylint: disable=too-few-public-methods
-class RsyncWrapper(object):
+class Extractor(object):
 
-    def __init__(self):
-        super(RsyncWrapper, self).__init__()
-        timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
-        self.suffix = "_" + timestr + ".old"
+    def __init__(self, basedir, crc_index=None, destination_dir=None):
+        super(Extractor, self).__init__()
+        self.basedir = basedir
+        self.crc_index = crc_index
+        self.destination_dir = destination_dir
+        self.pending_index = {}
+        self.changed_paths = set()
 
-    def sync(self, source, destination):
-        subprocess.call(["rsync", "--recursive", "--checksum", "--backup", "-v",
-                         "--suffix=" + self.suffix, source, destination])
+    @staticmethod
+    def remove_intermediary_dir(extracted_dir, intermediary_name=None):
+        if intermediary_name is None:
+            def _filter_dirs(base_name):
+                return os.path.isdir(os.path.join(extracted_dir, base_name))
 
+            subdirs = list(filter(_filter_dirs, os.listdir(extracted_dir)))
+            if len(subdirs) != 1:
+                return
+            intermediary_name = subdirs[0]
 
-class Extractor(object):
+        intermediary = os.path.join(extracted_dir, intermediary_name)
+        if not os.path.isdir(intermediary):
+            return
 
-    def __init__(self, basedir):
-        super(Extractor, self).__init__()
-        self.basedir = basedir
+        for filename in glob.iglob(os.path.join(intermediary, "*")):
+            shutil.move(filename, extracted_dir)
+        os.rmdir(intermediary)
 
     @staticmethod
-    def remove_intermediary_dir(extracted_dir):
-        def _filter_dirs(base_name):
-            return os.path.isdir(os.path.join(extracted_dir, base_name))
+    def find_intermediary_dir(member_parts):
+        """Returns the name of the only top level directory of an archive, if there is one"""
+        subdirs = set(parts[0] for parts, is_dir in member_parts if len(parts) > 1 or is_dir)
 
-        subdirs = list(filter(_filter_dirs, os.listdir(extracted_dir)))
         if len(subdirs) == 1:
-            intermediary = os.path.join(extracted_dir, subdirs[0])
-            for filename in glob.iglob(os.path.join(intermediary, "*")):
-                shutil.move(filename, extracted_dir)
-            os.rmdir(intermediary)
+            return subdirs.pop()
+
+        return None
 
     @staticmethod
     def remove_empty_dirs(directory):
@@ -165,20 +274,147 @@ class Extractor(object):
 
     @staticmethod
     def remove_filelist(directory):
-        filelist = os.path.join(directory, "archive_filelist.csv")
+        filelist = os.path.join(directory, FILELIST_FILENAME)
         if os.path.isfile(filelist):
             os.remove(filelist)
 
-    def extract(self, archive_filename, destination, cleanup=True):
+    def cleanup_extracted(self, destination, intermediary_name=None):
+        self.remove_filelist(destination)
+        self.remove_intermediary_dir(destination, intermediary_name)
+        self.remove_empty_dirs(destination)
+
+    def is_member_unchanged(self, member, entry, destination):
+        """Checks a member against its CRC index entry and the synced file on disk"""
+        if entry is None or member.has_data_descriptor or member.crc != entry["crc"] or \
+                member.file_size != entry["size"]:
+            return False
+
+        try:
+            stat = os.stat(os.path.join(self.destination_dir, destination, entry["path"]))
+        except OSError:
+            return False
+
+        return stat.st_size == entry["size"] and stat.st_mtime_ns == entry["mtime_ns"]
+
+    def extract_stream(self, stream, destination, cleanup=True, course_id=None,
+                       skip_unchanged=True):
+        """Extracts a zip archive while it is read from stream, without storing the archive
+
+        With a course_id, members that didn't change since the last sync according to the CRC
+        index are skipped without decompressing them. Members whose CRC changed are added to
+        changed_paths, since their size and modification time might still be the same. The index
+        is only updated by commit_index.
+        """
+        extract_dir = os.path.join(self.basedir, destination)
+
+        index = {}
+        if course_id is not None and self.crc_index:
+            index = self.crc_index.get_course(course_id)
+
+        # (parts, is_dir, member, skipped) of every member, including the skipped ones
+        members = []
+
         try:
-            with zipfile.ZipFile(archive_filename, "r") as archive:
-                destination = os.path.join(self.basedir, destination)
-                archive.extractall(destination)
-                if cleanup:
-                    self.remove_filelist(destination)
-                    self.remove_intermediary_dir(destination)
-                    self.remove_empty_dirs(destination)
-
-                return destination
-        except zipfile.BadZipFile:
-            raise ExtractionError("Cannot extract file {}".format(archive_filename))
+            for member in ZipStreamReader(stream).members():
+                parts = member.path_parts
+                if not parts or parts == [FILELIST_FILENAME]:
+                    continue
+
+                if member.is_dir:
+                    os.makedirs(member.target_path(extract_dir), exist_ok=True)
+                    members.append((parts, True, member, False))
+                    continue
+
+                if skip_unchanged and \
+                        self.is_member_unchanged(member, index.get(member.filename), destination):
+                    # The reader skips the data of members that weren't read
+                    members.append((parts, False, member, True))
+                    continue
+
+                target_path = member.target_path(extract_dir)
+                target_dir, target_name = os.path.split(target_path)
+                os.makedirs(target_dir, exist_ok=True)
+
+                # The member only gets its name once its CRC and size were verified
+                partial_path = os.path.join(target_dir, PARTIAL_FILE_PREFIX + target_name)
+                with open(partial_path, "wb") as target_file:
+                    for chunk in member.read_chunks():
+                        target_file.write(chunk)
+                os.replace(partial_path, target_path)
+
+                # Files keep their modification time, so unchanged files are detected cheaply
+                os.utime(target_path, (member.timestamp, member.timestamp))
+                members.append((parts, False, member, False))
+        except ZipStreamError as e:
+            # A partially extracted course must not reach the tree sync
+            shutil.rmtree(extract_dir, ignore_errors=True)
+            raise ExtractionError("Cannot extract archive: {}".format(e))
+        except BaseException:
+            shutil.rmtree(extract_dir, ignore_errors=True)
+            raise
+
+        # The intermediary directory has to be decided from all members, because the skipped ones
+        # are missing on disk
+        intermediary_name = None
+        if cleanup:
+            intermediary_name = self.find_intermediary_dir(
+                [(parts, is_dir) for parts, is_dir, _, _ in members])
+
+            if os.path.isdir(extract_dir):
+                self.cleanup_extracted(extract_dir, intermediary_name)
+
+        if course_id is not None and self.crc_index:
+            entries = []
+            for parts, is_dir, member, skipped in members:
+                if is_dir:
+                    continue
+
+                if intermediary_name is not None and len(parts) > 1 and \
+                        parts[0] == intermediary_name:
+                    parts = parts[1:]
+                path = os.path.join(*parts)
+
+                entry = index.get(member.filename)
+                if skipped and entry["path"] != path:
+                    # The file of a skipped member would now end up elsewhere, so it has to be
+                    # extracted again next time
+                    continue
+
+                if not skipped and entry is not None and entry["crc"] != member.crc:
+                    self.changed_paths.add(os.path.join(destination, path))
+
+                entries.append((member.filename, member.crc, member.file_size, path, skipped))
+
+            self.pending_index[course_id] = (destination, entries)
+
+        return extract_dir
+
+    def commit_index(self, changes):
+        """Writes the CRC index entries of all extracted archives once their files were synced
+
+        changes are the changes of the tree sync. Members whose file failed to sync or doesn't
+        have their size on disk are left out, so they are extracted again next time.
+        """
+        failed_paths = set(change["path"] for change in changes if change["action"] == "failed")
+
+        for course_id, (destination, entries) in self.pending_index.items():
+            index_entries = []
+            for name, crc, size, path, skipped in entries:
+                if os.path.join(destination, path) in failed_paths:
+                    continue
+
+                try:
+                    stat = os.stat(os.path.join(self.destination_dir, destination, path))
+                except OSError:
+                    continue
+
+                # Skipped members were already checked against the file on disk
+                if not skipped and stat.st_size != size:
+                    continue
+
+                index_entries.append((name, crc, size, path, stat.st_mtime_ns))
+
+            self.crc_index.replace_course(course_id, index_entries)
+
+        self.pending_index = {}
+        self.changed_paths = set()
@@ -0,0 +1,31 @@
+from studip_sync.helpers import SQLiteDatabase
+
+
+class SyncState(SQLiteDatabase):
+    """Remembers when each course was synchronized successfully for the last time
+
+    Courses without an entry fall back to default_last_sync, which is the global last_sync of
+    older versions.
+    """
+
+    def __init__(self, path, default_last_sync=0):
+        super(SyncState, self).__init__(path)
+        self.default_last_sync = default_last_sync
+
+    def _create_tables(self, connection):
+        connection.execute("CREATE TABLE IF NOT EXISTS courses ("
+                           "course_id TEXT PRIMARY KEY, "
+                           "last_sync INTEGER NOT NULL)")
+
+    def last_sync(self, course_id):
+        course = self.fetch_one("SELECT last_sync FROM courses WHERE course_id = ?",
+                                (course_id,))
+
+        if course is None:
+            return self.default_last_sync
+
+        return course["last_sync"]
+
+    def update_last_sync(self, course_id, last_sync):
+        self.execute("INSERT OR REPLACE INTO courses (course_id, last_sync) VALUES (?, ?)",
+                     (course_id, last_sync))
@@ -0,0 +1,163 @@
+import os
+import shutil
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from studip_sync.hash_cache import hash_file
+from studip_sync.session import PARTIAL_FILE_PREFIX
+
+
+class TreeSync(object):
+    """In-process replacement for rsync --recursive --checksum --backup
+
+    Files are compared by size and modification time first, only files with the same size but a
+    different modification time are compared by their hashes. The hashes of the destination files
+    are taken from hash_cache if possible, all hashes are computed in parallel. Replaced files are
+    kept with a "_<time>.old" suffix, files that only exist in the destination are left alone.
+    """
+
+    def __init__(self, hash_cache=None, jobs=None):
+        super(TreeSync, self).__init__()
+        timestr = datetime.strftime(datetime.now(), "%Y-%m-%d_%H+%M+%S")
+        self.suffix = "_" + timestr + ".old"
+        self.hash_cache = hash_cache
+        self.jobs = jobs or os.cpu_count() or 1
+
+    def sync(self, source, destination, force_compare=()):
+        """Moves all changed files from source to destination and returns the list of changes
+
+        Every change is a dict with the keys path, action ("created", "updated" or "failed"),
+        size, hash, backup and error. Paths are relative to destination. Files in force_compare
+        are known to have changed content and are compared by their hashes even if their size and
+        modification time match.
+        """
+        changes = []
+        compare = []
+
+        source_files = list_files(source)
+        for relative_path in source_files:
+            source_path = os.path.join(source, relative_path)
+            destination_path = os.path.join(destination, relative_path)
+            source_stat = os.stat(source_path)
+
+            try:
+                destination_stat = os.stat(destination_path)
+            except FileNotFoundError:
+                changes.append(self.change(relative_path, "created", source_stat))
+                continue
+
+            if not stat.S_ISREG(destination_stat.st_mode):
+                changes.append(self.change(relative_path, "failed", source_stat,
+                                           error="Destination is not a file"))
+            elif source_stat.st_size != destination_stat.st_size:
+                changes.append(self.change(relative_path, "updated", source_stat))
+            elif source_stat.st_mtime_ns != destination_stat.st_mtime_ns or \
+                    relative_path in force_compare:
+                compare.append((relative_path, source_path, source_stat, destination_path,
+                                destination_stat))
+
+        if compare:
+            with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+                hashes = list(executor.map(self.hash_pair, compare))
+
+            computed_hashes = []
+            for (relative_path, _, source_stat, destination_path, destination_stat), \
+                    (source_hash, destination_hash, computed) in zip(compare, hashes):
+                if computed:
+                    computed_hashes.append((destination_path, destination_stat, destination_hash))
+
+                if source_hash != destination_hash:
+                    changes.append(self.change(relative_path, "updated", source_stat,
+                                               source_hash))
+
+            if self.hash_cache and computed_hashes:
+                self.hash_cache.update_many(computed_hashes)
+
+        # Apply the changes in the order of the source tree, like rsync does
+        order = {relative_path: i for i, relative_path in enumerate(source_files)}
+        changes.sort(key=lambda change: order[change["path"]])
+
+        updated_hashes = []
+        for change in changes:
+            if change["action"] == "failed":
+                print("Cannot sync {}: {}".format(change["path"], change["error"]))
+                continue
+
+            destination_path = os.path.join(destination, change["path"])
+            try:
+                self.apply(os.path.join(source, change["path"]), destination_path, change)
+            except OSError as e:
+                change["action"] = "failed"
+                change["error"] = str(e)
+                print("Cannot sync {}: {}".format(change["path"], e))
+                continue
+
+            print(change["path"])
+
+            if change["hash"] is not None:
+                updated_hashes.append((destination_path, os.stat(destination_path),
+                                       change["hash"]))
+
+        if self.hash_cache and updated_hashes:
+            self.hash_cache.update_many(updated_hashes)
+
+        return changes
+
+    @staticmethod
+    def change(relative_path, action, source_stat, content_hash=None, error=None):
+        return {
+            "path": relative_path,
+            "action": action,
+            "size": source_stat.st_size,
+            "hash": content_hash,
+            "backup": None,
+            "error": error
+        }
+
+    def hash_pair(self, entry):
+        _, source_path, _, destination_path, destination_stat = entry
+
+        if self.hash_cache:
+            destination_hash, computed = self.hash_cache.hash(destination_path,
+                                                              destination_stat)
+        else:
+            destination_hash, computed = hash_file(destination_path), False
+
+        return hash_file(source_path), destination_hash, computed
+
+    def apply(self, source_path, destination_path, change):
+        destination_dir, filename = os.path.split(destination_path)
+        os.makedirs(destination_dir, exist_ok=True)
+
+        # The source tree is thrown away afterwards, so files are moved instead of copied if
+        # possible. The modification time is kept to make the next comparison cheap.
+        partial_path = os.path.join(destination_dir, PARTIAL_FILE_PREFIX + filename)
+        shutil.move(source_path, partial_path)
+
+        if change["action"] == "updated":
+            backup_path = destination_path + self.suffix
+            try:
+                os.link(destination_path, backup_path)
+            except OSError:
+                os.rename(destination_path, backup_path)
+            change["backup"] = change["path"] + self.suffix
+
+        os.replace(partial_path, destination_path)
+
+
+def list_files(directory):
+    """Returns the paths of all files below directory relative to it, in sorted order"""
+    files = []
+
+    for root, dirs, filenames in os.walk(directory):
+        dirs.sort()
+        relative_root = os.path.relpath(root, directory)
+
+        for filename in sorted(filenames):
+            if relative_root == os.curdir:
+                files.append(filename)
+            else:
+                files.append(os.path.join(relative_root, filename))
+
+    return files
@@ -0,0 +1,265 @@
+import os
+import struct
+import time
+import zlib
+
+CHUNK_SIZE = 64 * 1024
+
+LOCAL_FILE_HEADER_SIGNATURE = b"PK\x03\x04"
+CENTRAL_DIRECTORY_SIGNATURE = b"PK\x01\x02"
+END_OF_CENTRAL_DIRECTORY_SIGNATURES = (b"PK\x05\x06", b"PK\x06\x06", b"PK\x06\x07")
+DATA_DESCRIPTOR_SIGNATURE = b"PK\x07\x08"
+
+LOCAL_FILE_HEADER = struct.Struct("<HHHHHIIIHH")
+ZIP64_EXTRA_ID = 0x0001
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+
+class ZipStreamError(Exception):
+    pass
+
+
+class _StreamBuffer(object):
+
+    def __init__(self, stream):
+        super(_StreamBuffer, self).__init__()
+        self.stream = stream
+        self.buffer = b""
+
+    def read(self, size):
+        """Reads up to size bytes"""
+        if self.buffer:
+            data, self.buffer = self.buffer[:size], self.buffer[size:]
+            return data
+
+        return self.stream.read(size)
+
+    def read_full(self, size):
+        """Reads size bytes, or less only at the end of the stream"""
+        data = b""
+        while len(data) < size:
+            chunk = self.read(size - len(data))
+            if not chunk:
+                break
+            data += chunk
+
+        return data
+
+    def read_exact(self, size):
+        data = self.read_full(size)
+        if len(data) < size:
+            raise ZipStreamError("Unexpected end of archive")
+
+        return data
+
+    def unread(self, data):
+        self.buffer = data + self.buffer
+
+
+class ZipStreamMember(object):
+    """Member of a zip archive that is read from its local file header
+
+    The data of a member can only be read once and has to be read before the next member.
+    """
+
+    def __init__(self, buffer, flags, method, dos_time, dos_date, crc, compress_size, file_size,
+                 filename, zip64):
+        super(ZipStreamMember, self).__init__()
+        self._buffer = buffer
+        self._zip64 = zip64
+        self.flags = flags
+        self.method = method
+        self.date_time = ((dos_date >> 9) + 1980, (dos_date >> 5) & 0xF, dos_date & 0x1F,
+                          dos_time >> 11, (dos_time >> 5) & 0x3F, (dos_time & 0x1F) * 2)
+        self.crc = crc
+        self.compress_size = compress_size
+        self.file_size = file_size
+        self.filename = filename
+        self.consumed = False
+
+        # Directories have no data, so their size is known even if it is only written afterwards
+        if self.has_data_descriptor and self.method != METHOD_DEFLATED and not self.is_dir:
+            raise ZipStreamError(
+                "Cannot stream member with unknown size: {}".format(filename))
+
+        if self.method not in (METHOD_STORED, METHOD_DEFLATED):
+            raise ZipStreamError(
+                "Unsupported compression method {}: {}".format(method, filename))
+
+    @property
+    def has_data_descriptor(self):
+        return bool(self.flags & FLAG_DATA_DESCRIPTOR)
+
+    @property
+    def timestamp(self):
+        """Modification time of this member, zip archives store it in local time"""
+        return time.mktime(self.date_time + (0, 0, -1))
+
+    @property
+    def is_dir(self):
+        return self.filename.endswith("/")
+
+    @property
+    def path_parts(self):
+        """Components of the path of this member, with the same sanitizing as zipfile"""
+        path = os.path.splitdrive(self.filename.replace("\\", "/"))[1]
+        return [part for part in path.split("/") if part not in ("", ".", "..")]
+
+    def target_path(self, destination):
+        return os.path.join(destination, *self.path_parts)
+
+    def read_chunks(self):
+        """Yields the uncompressed data of this member and verifies its CRC"""
+        if self.consumed:
+            raise ZipStreamError("Member was already read: {}".format(self.filename))
+        self.consumed = True
+
+        crc = 0
+        size = 0
+
+        if self.method == METHOD_STORED:
+            chunks = self._read_stored()
+        else:
+            chunks = self._read_deflated()
+
+        for chunk in chunks:
+            crc = zlib.crc32(chunk, crc)
+            size += len(chunk)
+            yield chunk
+
+        if self.has_data_descriptor:
+            self._read_data_descriptor()
+
+        if crc != self.crc or size != self.file_size:
+            raise ZipStreamError("Bad CRC or size of member: {}".format(self.filename))
+
+    def skip(self):
+        """Skips the data of this member, without decompressing it if its size is known"""
+        if self.consumed:
+            return
+
+        if self.has_data_descriptor:
+            for _ in self.read_chunks():
+                pass
+            return
+
+        self.consumed = True
+
+        remaining = self.compress_size
+        while remaining > 0:
+            chunk = self._buffer.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ZipStreamError("Unexpected end of archive")
+            remaining -= len(chunk)
+
+    def _read_stored(self):
+        remaining = 0 if self.has_data_descriptor else self.compress_size
+        while remaining > 0:
+            chunk = self._buffer.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                raise ZipStreamError("Unexpected end of archive")
+            remaining -= len(chunk)
+            yield chunk
+
+    def _read_deflated(self):
+        decompressor = zlib.decompressobj(-15)
+        # With a data descriptor the compressed size is unknown, the end of the member is
+        # detected by the decompressor instead
+        remaining = None if self.has_data_descriptor else self.compress_size
+
+        while not decompressor.eof:
+            if decompressor.unconsumed_tail:
+                data = decompressor.unconsumed_tail
+            else:
+                if remaining == 0:
+                    raise ZipStreamError("Truncated member: {}".format(self.filename))
+
+                data = self._buffer.read(CHUNK_SIZE if remaining is None
+                                         else min(CHUNK_SIZE, remaining))
+                if not data:
+                    raise ZipStreamError("Unexpected end of archive")
+
+                if remaining is not None:
+                    remaining -= len(data)
+
+            # Limit the output per step to keep the memory usage bounded
+            chunk = decompressor.decompress(data, CHUNK_SIZE)
+            if chunk:
+                yield chunk
+
+        if decompressor.unused_data:
+            self._buffer.unread(decompressor.unused_data)
+
+    def _read_data_descriptor(self):
+        size_format = "<QQ" if self._zip64 else "<II"
+        size_length = struct.calcsize(size_format)
+
+        data = self._buffer.read_exact(4)
+        if data == DATA_DESCRIPTOR_SIGNATURE:
+            data = self._buffer.read_exact(4)
+
+        self.crc = struct.unpack("<I", data)[0]
+        self.compress_size, self.file_size = struct.unpack(
+            size_format, self._buffer.read_exact(size_length))
+
+
+class ZipStreamReader(object):
+    """Reads a zip archive from a stream front to back, using only the local file headers
+
+    In contrast to zipfile this doesn't need the central directory at the end of the archive, so
+    members can be extracted while the archive is still being downloaded.
+    """
+
+    def __init__(self, stream):
+        super(ZipStreamReader, self).__init__()
+        self._buffer = _StreamBuffer(stream)
+
+    def members(self):
+        while True:
+            signature = self._buffer.read_full(4)
+
+            if len(signature) < 4 or signature == CENTRAL_DIRECTORY_SIGNATURE or \
+                    signature in END_OF_CENTRAL_DIRECTORY_SIGNATURES:
+                # The central directory only repeats what the local headers already contained
+                return
+
+            if signature != LOCAL_FILE_HEADER_SIGNATURE:
+                raise ZipStreamError("Invalid local file header")
+
+            member = self._read_member()
+            yield member
+
+            member.skip()
+
+    def _read_member(self):
+        (_, flags, method, dos_time, dos_date, crc, compress_size, file_size, filename_length,
+         extra_length) = LOCAL_FILE_HEADER.unpack(self._buffer.read_exact(LOCAL_FILE_HEADER.size))
+
+        filename = self._buffer.read_exact(filename_length)
+        extra = self._buffer.read_exact(extra_length)
+
+        if flags & FLAG_UTF8:
+            filename = filename.decode("utf-8")
+        else:
+            filename = filename.decode("cp437")
+
+        zip64 = False
+        while len(extra) >= 4:
+            extra_id, length = struct.unpack("<HH", extra[:4])
+            if extra_id == ZIP64_EXTRA_ID:
+                zip64 = True
+                values = extra[4:4 + length]
+                if file_size == 0xFFFFFFFF and len(values) >= 8:
+                    file_size = struct.unpack("<Q", values[:8])[0]
+                    values = values[8:]
+                if compress_size == 0xFFFFFFFF and len(values) >= 8:
+                    compress_size = struct.unpack("<Q", values[:8])[0]
+            extra = extra[4 + length:]
+
+        return ZipStreamMember(self._buffer, flags, method, dos_time, dos_date, crc,
+                               compress_size, file_size, filename, zip64)